@@ -0,0 +1,109 @@
+"""
+Time the tracking pipeline on synthetic samples
+Usage: python -m benchmarks.run --cells 20 50 --slices 200 500 --output benchmark.json
+"""
+import argparse
+import contextlib
+import io
+import itertools
+import json
+import platform
+import random
+import tempfile
+import time
+import tracemalloc
+from benchmarks.synthetic import *
+from src.data import Data
+from src.getfps import Fps
+from src.util import Diffusion, read_results
+
+
+@contextlib.contextmanager
+def measure(stages, name):
+    """Record wall time and peak traced memory of a stage"""
+    tracemalloc.start()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+    stages[name] = {"seconds": time.perf_counter() - start, "peak_mb": tracemalloc.get_traced_memory()[1] / 2**20}
+    tracemalloc.stop()
+
+
+def accuracy(dataframe, truth):
+    """Fraction of real detections labelled with the main ID of their cell"""
+    df = pd.DataFrame({"ID": dataframe.ID.values, "TrueID": truth.loc[dataframe.index].values})
+    df = df[df.TrueID != -1]
+    main_id = df[df.ID != -1].groupby("TrueID").ID.agg(lambda ids: ids.mode()[0])
+    return float((df.ID.values == df.TrueID.map(main_id).values).mean())
+
+
+def run_case(path, method="kdtree", rounds=1, fast=False, seed=0, **kwargs):
+    """
+    Input:
+        path: temporary directory
+        method: passed to Data.sort
+        rounds, fast: passed to Data.improve
+        kwargs: passed to make_cells
+    Output: dictionary of parameters, stage timings and accuracy
+    """
+    file, images, df = write_sample(path, "bench", seed=seed, **kwargs)
+    random.seed(seed)
+    stages = {}
+
+    with measure(stages, "read"):
+        data = Data(read_results(file))
+    with measure(stages, "fps"):
+        fps = Fps(images)
+        data.add_time(fps)
+    with measure(stages, "sort"):
+        data.sort(method=method)
+    sort_accuracy = accuracy(data.dataframe, df.TrueID)
+    with measure(stages, "improve"):
+        data.improve(rounds=rounds, fast=fast)
+    with measure(stages, "diffusion"):
+        brownian = Diffusion(data, seed=seed).result
+    with measure(stages, "get_results"):
+        data.get_results(brownian)
+
+    return {"parameters": {"method": method, "rounds": rounds, "fast": fast, "seed": seed, **kwargs},
+            "detections": len(df),
+            "stages": stages,
+            "accuracy": {"sort": sort_accuracy, "improve": accuracy(data.dataframe, df.TrueID)},
+            "cells_found": len(data.results.freq)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the cell tracking pipeline on synthetic data")
+    parser.add_argument("--cells", type=int, nargs="+", default=[20, 50])
+    parser.add_argument("--slices", type=int, nargs="+", default=[200, 500])
+    parser.add_argument("--freq", type=float, nargs=2, default=[0.5, 5.0])
+    parser.add_argument("--noise", type=float, nargs="+", default=[0.3])
+    parser.add_argument("--dropout", type=float, nargs="+", default=[0.05])
+    parser.add_argument("--spurious", type=float, default=2.0, help="unrelated detections per image")
+    parser.add_argument("--method", nargs="+", default=["kdtree"], choices=["kdtree", "hungarian", "legacy"],
+                        help="sorting methods to compare")
+    parser.add_argument("--rounds", type=int, default=1)
+    parser.add_argument("--fast", action="store_true")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="benchmark.json")
+    args = parser.parse_args()
+
+    results = []
+    grid = itertools.product(args.method, args.cells, args.slices, args.noise, args.dropout)
+    for method, cells, slices, noise, dropout in grid:
+        with tempfile.TemporaryDirectory() as path:
+            result = run_case(path, method=method, rounds=args.rounds, fast=args.fast, seed=args.seed, cells=cells,
+                              slices=slices, freq=tuple(args.freq), noise=noise, dropout=dropout,
+                              spurious=args.spurious)
+        results += result,
+        total = sum(stage["seconds"] for stage in result["stages"].values())
+        print(f"{method} cells={cells} slices={slices} noise={noise} dropout={dropout}: "
+              f"{total:.2f} s (sort {result['stages']['sort']['seconds']:.2f} s), "
+              f"accuracy {result['accuracy']['improve']:.3f}")
+
+    with open(args.output, "w") as f:
+        json.dump({"python": platform.python_version(), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""Synthetic ImageJ-style results and image series of rotating cells"""
+import datetime
+import os
+import numpy as np
+import pandas as pd
+from PIL import Image
+
+
+def make_cells(cells=50, slices=500, freq=(0.5, 5.0), noise=0.3, dropout=0.05, spurious=2.0,
+               fps=50, size=None, seed=0):
+    """
+    Input:
+        cells: number of tethered cells
+        slices: number of images
+        freq: range of rotation frequencies; 1/s
+        noise: standard deviation of the position noise; px
+        dropout: probability that a cell is not detected in an image
+        spurious: mean number of unrelated detections per image
+        fps: frame rate
+        size: width and height of the field of view; px, scaled to a constant cell density if None
+        seed: seed of the random generator
+    Output: dataframe of detections with a TrueID column (-1 for spurious detections)
+    """
+    rng = np.random.default_rng(seed)
+    size = size or int(512 * (cells / 50) ** 0.5)
+    centre = rng.uniform(20, size - 20, (cells, 2))
+    frequency = rng.uniform(*freq, cells) * rng.choice([-1, 1], cells)
+    phase = rng.uniform(0, 360, cells)
+    length = rng.normal(15, 1.5, cells)
+    width = rng.normal(6, 0.5, cells)
+
+    # cells rotate around their attachment point, which is off-centre
+    time = np.arange(slices) / fps
+    angle = (phase + 360 * np.outer(time, frequency)) % 360
+    x = centre[:, 0] + length / 3 * np.cos(np.radians(angle)) + rng.normal(0, noise, angle.shape)
+    y = centre[:, 1] - length / 3 * np.sin(np.radians(angle)) + rng.normal(0, noise, angle.shape)
+    slice_ind, cell_ind = np.nonzero(rng.random(angle.shape) > dropout)
+    df = pd.DataFrame({
+        "X": x[slice_ind, cell_ind],
+        "Y": y[slice_ind, cell_ind],
+        "Major": length[cell_ind] + rng.normal(0, 0.5, len(cell_ind)),
+        "Minor": width[cell_ind] + rng.normal(0, 0.3, len(cell_ind)),
+        "Angle": angle[slice_ind, cell_ind] % 180,
+        "Slice": slice_ind + 1,
+        "TrueID": cell_ind})
+
+    n = rng.poisson(spurious * slices)
+    noise_df = pd.DataFrame({
+        "X": rng.uniform(0, size, n),
+        "Y": rng.uniform(0, size, n),
+        "Major": rng.uniform(8, 25, n),
+        "Minor": rng.uniform(4, 8, n),
+        "Angle": rng.uniform(0, 180, n),
+        "Slice": rng.integers(1, slices + 1, n),
+        "TrueID": -1})
+
+    df = pd.concat([df, noise_df]).sort_values("Slice", kind="stable", ignore_index=True)
+    df["Area"] = np.pi * df.Major * df.Minor / 4
+    df["Mean"] = 100.0
+    df["Min"] = 50.0
+    df["Max"] = 150.0
+    df.insert(0, " ", np.arange(1, len(df) + 1))
+    return df[[" ", "Area", "Mean", "Min", "Max", "X", "Y", "Major", "Minor", "Angle", "Slice", "TrueID"]]
+
+
+def write_images(folder, name, slices, fps=50, start=datetime.datetime(2024, 1, 1, 12)):
+    """Write a series of small tif images with EXIF DateTime timestamps"""
+    os.makedirs(folder, exist_ok=True)
+    image = Image.fromarray(np.zeros((8, 8), np.uint8))
+    images = []
+    for i in range(slices):
+        time = start + datetime.timedelta(seconds=i / fps)
+        path = os.path.join(folder, f"{name}-{i + 1}.tif")
+        image.save(path, tiffinfo={306: time.strftime("%Y:%m:%d %H:%M:%S")})
+        images += path,
+    return images
+
+
+def write_sample(path, name, fps=50, **kwargs):
+    """
+    Input:
+        path: directory of the sample
+        name: name of the sample
+        kwargs: passed to make_cells
+    Output: csv file path, list of image file paths, dataframe with TrueID column
+    """
+    df = make_cells(fps=fps, **kwargs)
+    file = os.path.join(path, f"Results_{name}.csv")
+    df.drop(columns="TrueID").to_csv(file, index=False)
+    images = write_images(os.path.join(path, name), name, df.Slice.max(), fps)
+    return file, images, df
@@ -0,0 +1,103 @@
+"""Process samples of a folder in parallel without user interaction"""
+import contextlib
+import io
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from src.cache import *
+from src.getfps import *
+
+
+def process_sample(file, images, sort=False, method="kdtree", min_coverage=0.25, rounds=0, fast=False, n_jobs=-1,
+                   max_samples=None, px_to_m=0.185e-6, p=0.01, engine=None, cache=False, profile=None, memory=False,
+                   cprofile=False, figures=None, keep=None):
+    """
+    Input:
+        file: path to csv file of one sample
+        images: list of image file paths of that sample
+        method: sorting method, see Data.sort
+        rounds, fast, n_jobs, max_samples: passed to Data.improve
+        p: p-value of the brownian rotation threshold
+        engine: pandas csv engine, e.g. "pyarrow"
+        cache: reuse or write tracked cells in a feather file next to the csv file
+        profile: "json" or "csv" to write a report of stage timings to <file>.profile.<profile>
+        memory: include peak memory of each stage in the report
+        cprofile: also dump cProfile statistics next to the report
+        figures: directory to write the map, rotation and boxplot figures of the sample to
+        keep: dataframe columns to return; all if None, see Data.drop_frames
+    Output: processed Data object
+    """
+    if profile:
+        profiler.enable(memory=memory, cprofile=cprofile)
+
+    try:
+        if cache:
+            key = cache_key(file, sort=sort, method=method, min_coverage=min_coverage, rounds=rounds, fast=fast,
+                            max_samples=max_samples, px_to_m=px_to_m)
+            path = cache_path(file, key)
+        if cache and os.path.exists(path):
+            data = load_cache(path)
+        else:
+            data = Data(read_results(file, engine))
+            fps = Fps(images)
+
+            data.add_time(fps)
+            data.results.fps += list(fps.values)
+            if sort:
+                data.sort(min_coverage, method)
+
+            data.improve(rounds=rounds, fast=fast, n_jobs=n_jobs, max_samples=max_samples)
+            if cache:
+                save_cache(data, path)
+
+        data.px_to_m = px_to_m
+        data.get_results(Diffusion(data, p=p).result)
+
+        if profile:
+            profiler.save(os.path.splitext(file)[0] + ".profile." + profile)
+    finally:
+        # a failing stage must not leave tracemalloc and cProfile running in the process
+        if profile:
+            profiler.disable()
+
+    if figures:
+        sample = os.path.join(figures, os.path.splitext(os.path.basename(file))[0])
+        data.plot_map(sample + "_map.png")
+        data.plot_rotation_cum(sample + "_rotation.png")
+        data.plot_boxplot(sample + "_boxplot.png")
+
+    # the trained model is not needed after improvement and is expensive to send between processes
+    data.model = None
+    data.score = None
+    if keep is not None:
+        data.drop_frames(keep)
+    return data
+
+
+def _process_quietly(*args, **kwargs):
+    # output of parallel samples would be interleaved; progress is reported by run_batch instead
+    with contextlib.redirect_stdout(io.StringIO()):
+        return process_sample(*args, **kwargs)
+
+
+def run_batch(path, workers=None, **kwargs):
+    """
+    Input:
+        path: path to directory
+        workers: number of processes; all cores if None
+        kwargs: passed to process_sample
+    Output: list of Data objects in the order of the csv files, with results but without the cell table
+    """
+    # samples already run on all cores; a parallel classifier in every process would oversubscribe them
+    kwargs.setdefault("n_jobs", 1)
+    # the parent holds the results of all samples, but the cell table of none
+    kwargs.setdefault("keep", ())
+    files, images = find_files(path)
+    data_list = [None] * len(files)
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(_process_quietly, file, images[i], **kwargs): i for i, file in enumerate(files)}
+        for done, future in enumerate(as_completed(futures)):
+            i = futures[future]
+            data_list[i] = future.result()
+            print(f"Processed sample {i + 1} ({os.path.basename(files[i])}), {done + 1} of {len(files)} done")
+
+    return data_list
@@ -0,0 +1,54 @@
+"""Binary cache of tracked samples next to the input csv"""
+import hashlib
+import json
+import os
+import pyarrow as pa
+from pyarrow import feather
+from src.data import *
+
+# increase when tracking or timestamp reconstruction changes, so that files written before are not reused
+CACHE_VERSION = 2
+
+
+def cache_key(file, **params):
+    """
+    Input:
+        file: path to csv file
+        params: pipeline parameters that change the tracked data
+    Output: hash of file content and parameters; str
+    """
+    key = hashlib.sha256()
+    with open(file, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            key.update(chunk)
+    key.update(json.dumps({"version": CACHE_VERSION, **params}, sort_keys=True).encode())
+    return key.hexdigest()[:16]
+
+
+def cache_path(file, key):
+    return os.path.splitext(file)[0] + f".{key}.feather"
+
+
+def save_cache(data, path):
+    """Write the tracked dataframe with start time and fps values"""
+    table = pa.Table.from_pandas(data.dataframe)
+    metadata = {**table.schema.metadata,
+                b"cell_tracker": json.dumps({"start_time": float(data.start_time),
+                                             "fps": [int(fps) for fps in data.results.fps],
+                                             "slices": int(data.slices)}).encode()}
+    # uncompressed so that the file can be memory-mapped
+    feather.write_feather(table.replace_schema_metadata(metadata), path, compression="uncompressed")
+
+
+def load_cache(path):
+    """
+    Input: path to cache file
+    Output: Data object with tracked cells and timestamps
+    """
+    table = feather.read_table(path, memory_map=True)
+    metadata = json.loads(table.schema.metadata[b"cell_tracker"])
+    data = Data(table.to_pandas())
+    data.start_time = metadata["start_time"]
+    data.results.fps += metadata["fps"]
+    data.slices = metadata["slices"]
+    return data
@@ -0,0 +1,60 @@
+"""
+Process experiment folders without a display
+Usage: python -m src.cli <folder> [<folder> ...] --output <directory> [options]
+"""
+import argparse
+import os
+import matplotlib
+matplotlib.use("Agg")  # Figures are written to files; must be set before pyplot is imported
+from src.batch import *
+from src.resultstore import ResultStore
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Track and analyse rotating cells")
+    parser.add_argument("folders", nargs="+", help="folders with Results_<name>.csv files and image subfolders")
+    parser.add_argument("-o", "--output", default=".", help="directory for figures")
+    parser.add_argument("--sort", action="store_true", help="sort cells; needed unless csv files contain IDs")
+    parser.add_argument("--method", choices=["kdtree", "hungarian", "legacy"], default="kdtree",
+                        help="sorting method")
+    parser.add_argument("--min-coverage", type=float, default=0.25)
+    parser.add_argument("--rounds", type=int, default=0, help="rounds of machine learning improvement")
+    parser.add_argument("--fast", action="store_true", help="use the warm-started classifier for improvement")
+    parser.add_argument("--n-jobs", type=int, default=1,
+                        help="cores used by the classifier of each sample; all if -1")
+    parser.add_argument("--max-samples", type=float, default=None,
+                        help="fraction of rows used to train each tree of the fast classifier")
+    parser.add_argument("--px-to-m", type=float, default=0.185e-6)
+    parser.add_argument("--p", type=float, default=0.01, help="p-value of the brownian rotation threshold")
+    parser.add_argument("--workers", type=int, default=None, help="number of processes; all cores by default")
+    parser.add_argument("--cache", action="store_true", help="cache tracked cells next to the csv files")
+    parser.add_argument("--profile", choices=["json", "csv"], help="write stage timings next to the csv files")
+    parser.add_argument("--profile-memory", action="store_true", help="include peak memory of each stage")
+    parser.add_argument("--cprofile", action="store_true", help="also dump cProfile statistics of each sample")
+    parser.add_argument("--samples", action="store_true",
+                        help="also plot map, rotation and boxplot of each sample, written by its worker")
+    parser.add_argument("--store", help="SQLite file to add the results to, with the folder name as experiment")
+    args = parser.parse_args(args)
+
+    os.makedirs(args.output, exist_ok=True)
+    for folder in args.folders:
+        print(f"Processing {folder}")
+        data_list = run_batch(folder, workers=args.workers, sort=args.sort, method=args.method,
+                              min_coverage=args.min_coverage, rounds=args.rounds, fast=args.fast,
+                              n_jobs=args.n_jobs, max_samples=args.max_samples,
+                              px_to_m=args.px_to_m, p=args.p, cache=args.cache, profile=args.profile,
+                              memory=args.profile_memory, cprofile=args.cprofile,
+                              figures=args.output if args.samples else None)
+        name = os.path.basename(os.path.normpath(folder))
+        plot_freq_together(data_list, os.path.join(args.output, f"{name}_frequency.png"))
+
+        files, _ = find_files(folder)
+        if args.store:
+            store = ResultStore(args.store)
+            for file, data in zip(files, data_list):
+                store.add(data, name, os.path.splitext(os.path.basename(file))[0])
+            store.close()
+
+
+if __name__ == "__main__":
+    main()
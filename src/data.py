@@ -1,35 +1,49 @@
+from concurrent.futures import ThreadPoolExecutor
 from src.util import *
+from src.tracks import TrackStore
+from src import plot
+from src.plot import plot_freq_together
 
 
 class Data:
     """A class to store and process data"""
     def __init__(self, my_dataframe):
         self.dataframe = my_dataframe
-        self.best = my_dataframe.copy()
+        self.best = None  # ID of each row label in the grouping with the best rms score
         self.rms = 1
         self.score = None
+        self.model = None
+        self.fast = False
+        self.n_jobs = -1
+        self.max_samples = None
+        self.sort_method = None
         self.slices = my_dataframe["Slice"].max()
         self.results = Results()
         self.start_time = None
+        self.time_range = None  # first and last time, kept when the dataframe is dropped
         self.px_to_m = 0.185e-6
         self.brownian = None
         if "ID" not in list(self.dataframe):
             self.dataframe.Angle = 180 - self.dataframe.Angle
             self.dataframe["AspectRatio"] = self.dataframe.Major / self.dataframe.Minor
 
-    def sort(self, min_coverage=0.25):
-        """Perform initial proximity-based sorting"""
+    @profiled("sort")
+    def sort(self, min_coverage=0.25, method="kdtree"):
+        """Perform initial proximity-based sorting
+        method: "kdtree" for frame-to-frame linking, "hungarian" for optimal frame-to-frame assignment,
+        "legacy" for seed-based grouping"""
         print("Sorting cells...")
-        cells = len(self.dataframe)
-        progress_updates = [0.2, 0.4, 0.6, 0.8, 1.0]
-        grouped = []
-        while len(self.dataframe) > 0:
-            self.dataframe, my_group = group(self.dataframe)
-            grouped += my_group,
-            progress = (cells - len(self.dataframe))/cells
-            if progress >= progress_updates[0]:
-                print(f"{int(progress_updates[0]*100)}%")
-                del progress_updates[0]
+        self.sort_method = method
+        # scores of an earlier grouping do not apply to the new one
+        self.best = None
+        self.rms = 1
+        if method in ("kdtree", "hungarian"):
+            grouped = track(self.dataframe, method)
+            print("100%")
+        elif method == "legacy":
+            grouped = self._sort_legacy()
+        else:
+            raise ValueError(f"Unknown sorting method: {method}")
 
         good = [df for df in grouped if len(df) >= self.slices*min_coverage]  # Coverage filter
         bad = [df for df in grouped if len(df) < self.slices*min_coverage]  # Rejects are grouped together
@@ -45,38 +59,71 @@ class Data:
 
         if len(good) > 0:
             good = pd.concat(good)
-            self.dataframe = pd.concat([good, bad]).copy()
+            self.dataframe = pd.concat([good, bad])
         else:
-            self.dataframe = bad.copy()
+            self.dataframe = bad
 
+    def _sort_legacy(self):
+        cells = len(self.dataframe)
+        progress_updates = [0.2, 0.4, 0.6, 0.8, 1.0]
+        grouped = []
+        while len(self.dataframe) > 0:
+            self.dataframe, my_group = group(self.dataframe)
+            grouped += my_group,
+            progress = (cells - len(self.dataframe))/cells
+            if progress >= progress_updates[0]:
+                print(f"{int(progress_updates[0]*100)}%")
+                del progress_updates[0]
+        return grouped
+
+    @profiled("improve_round")
     def _improve(self):
         """Use machine learning to improve grouping"""
-        if not self.score:
+        if self.score is None:
             self.predict()
         rms = get_rms(self.dataframe, self.score)
         if rms < self.rms:
             self.rms = rms
-            self.best = self.dataframe.copy()
-
-        # Create a table with 1st and 2nd best IDs as columns
-        ranks = pd.DataFrame(
-            self.score.columns.to_series()[self.score.apply(pl.argsort, axis=1).values[:, ::-1][:, :2]],
-            index=self.score.index, columns=["1st", "2nd"])
-
-        self.dataframe["ID"] = self.dataframe.apply(
-            lambda row: int(ranks.loc[row.name, "1st"])
-            if self.score.loc[row.name, ranks.loc[row.name, "1st"]] > 0.8
-            or int(ranks.loc[row.name, "1st"]) != row["ID"]
-            else int(ranks.loc[row.name, "2nd"]),
-            axis=1)
-
+            self.best = self.dataframe.ID.copy()
+        profiler.count("rms", rms)
+        old_ids = self.dataframe.ID.values.copy()
+
+        # 1st and 2nd best IDs of every row
+        score = self.score.loc[self.dataframe.index]
+        values = score.values
+        columns = score.columns.astype(int).values
+        ranks = np.argsort(values, axis=1)[:, ::-1][:, :2]
+        rows = np.arange(len(values))
+        first, second = columns[ranks[:, 0]], columns[ranks[:, 1]]
+
+        # keep the best ID unless it is the current one with a low score
+        keep = (values[rows, ranks[:, 0]] > 0.8) | (first != self.dataframe.ID.values)
+        self.dataframe["ID"] = np.where(keep, first, second)
+        profiler.count("relabelled", int((self.dataframe.ID.values != old_ids).sum()))
+
+        unassigned = (self.dataframe.ID == -1).sum()
         self.remove_distant()
+        profiler.count("distant_removed", int((self.dataframe.ID == -1).sum() - unassigned))
+        unassigned = (self.dataframe.ID == -1).sum()
         self.remove_duplicates(self.score)
+        profiler.count("duplicates_removed", int((self.dataframe.ID == -1).sum() - unassigned))
         self.score = None
 
-    def improve(self, rounds=5):
+    @profiled("improve")
+    def improve(self, rounds=None, fast=False, n_jobs=-1, max_samples=None):
+        """
+        rounds: rounds of relabelling; by default none after hungarian sorting, which has no duplicates, else 5
+        fast: train a warm-started classifier that reuses trees between rounds
+        n_jobs: number of cores used by the classifier; all if -1
+        max_samples: fraction of rows used to train each tree of the classifier; all if None
+        """
+        if rounds is None:
+            rounds = 0 if self.sort_method == "hungarian" else 5
         if rounds < 1:
             return
+        self.fast = fast
+        self.n_jobs = n_jobs
+        self.max_samples = max_samples
 
         for i in range(rounds):
             if i == 0:
@@ -88,153 +135,128 @@ class Data:
         rms = get_rms(self.dataframe, self.score)
         if rms < self.rms:
             self.rms = rms
-            self.best = self.dataframe.copy()
-        # restore data that had the best rms score
-        self.dataframe = self.best.copy()
+            self.best = self.dataframe.ID.copy()
+        # restore grouping that had the best rms score, possibly of an earlier call with rows in another order
+        if self.best is not None:
+            self.dataframe["ID"] = self.best.loc[self.dataframe.index].values
         self.dataframe.sort_values(by=" ", inplace=True)
 
-    def remove_distant(self):
-        """Apply proximity filter"""
-        for cell_ID in list(set(self.dataframe.ID.values)):
-            if cell_ID == -1:
-                continue
-            subset = self.dataframe[self.dataframe.ID == cell_ID].copy()
-            xy_mean = subset[["X", "Y"]].mean().values.tolist()
-            subset["Distance"] = distance(xy_mean, [subset["X"], subset["Y"]])
-            xy_nearest = subset.loc[subset.Distance == subset.Distance.min(), ["X", "Y"]].mean().values.tolist()
-            subset["Distance"] = distance(xy_nearest, [subset["X"], subset["Y"]])
-            ind = subset[subset.Distance > 1.1 * subset.Major.quantile(0.9)].index
-            self.dataframe.loc[ind, "ID"] = -1
+    def remove_distant(self, workers=1):
+        """Apply proximity filter
+        workers: number of threads, each filtering a block of cells; the pandas transforms mostly hold the GIL,
+        so more than one worker only helps on several cores, and is slower than one on a single core"""
+        if workers > 1:
+            # one stable sort by ID; every thread gets a contiguous block of whole cells in their original row order
+            cells = self.dataframe[["ID", "X", "Y", "Major"]]
+            cells = cells.iloc[np.argsort(cells.ID.values, kind="stable")]
+            ids = cells.ID.values
+            starts = np.flatnonzero(np.diff(ids, prepend=ids[0] - 1))
+            bounds = np.append(starts[np.linspace(0, len(starts), workers + 1)[:-1].astype(int)], len(ids))
+            blocks = [cells.iloc[start:stop] for start, stop in zip(bounds[:-1], bounds[1:]) if stop > start]
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                distant = np.concatenate(list(executor.map(get_distant, blocks)))
+            self.dataframe.loc[cells.index[distant], "ID"] = -1
+        else:
+            self.dataframe.loc[get_distant(self.dataframe), "ID"] = -1
 
     def remove_duplicates(self, score):
         """Filter lower-scoring duplicates"""
-        duplicates = self.dataframe[self.dataframe.duplicated(subset=["Slice", "ID"], keep=False)]
-        duplicates = duplicates[duplicates.ID != -1].groupby(["Slice", "ID"])
-
-        for key, item in duplicates:
-            pair = duplicates.get_group(key)
-            # get full score table
-            score_pair = score.loc[pair.index]
-            # get only the scores for their own ID
-            score_pair = score_pair[[i for i in list(score_pair) if i == str(pair.ID.values[0])]]
-            # get index of cell with the lower score
-            ind = score_pair[score_pair.iloc[:, [0]] != score_pair.max()].dropna().index
-            # change group of the loser to -1
-            self.dataframe.loc[ind, "ID"] = -1
+        ids = self.dataframe.ID.values
+        slices = self.dataframe.Slice.values
+        score = score.loc[self.dataframe.index]
+        # score of each row for its own ID
+        columns = pd.Index(score.columns.astype(int))
+        own = score.values[np.arange(len(score)), columns.get_indexer(ids)]
+
+        # sort by group and score, then compare each row to the best score of its group
+        order = np.lexsort((own, ids, slices))
+        new_group = np.ones(len(order), dtype=bool)
+        new_group[1:] = (slices[order][1:] != slices[order][:-1]) | (ids[order][1:] != ids[order][:-1])
+        starts = np.flatnonzero(new_group)
+        sizes = np.diff(np.append(starts, len(order)))
+        best = np.repeat(own[order][starts + sizes - 1], sizes)
+
+        # change group of the losers to -1
+        loser = (own[order] < best) & (ids[order] != -1)
+        self.dataframe.iloc[order[loser], self.dataframe.columns.get_loc("ID")] = -1
+
+    def get_time_range(self):
+        if self.time_range is not None:
+            return self.time_range
+        return self.dataframe.Time.min(), self.dataframe.Time.max()
+
+    def drop_frames(self, columns=()):
+        """Keep the results but only the given dataframe columns, e.g. X, Y and ID for plot_map"""
+        self.time_range = self.get_time_range()
+        self.dataframe = self.dataframe[list(columns)].reset_index(drop=True)
+        self.best = None
 
     def add_time(self, fps):
-        self.dataframe["Time"] = self.dataframe.Slice.apply(lambda slc: fps.time_dict[slc])
+        self.dataframe["Time"] = fps.time_array[self.dataframe.Slice.values]
         self.start_time = fps.start
 
+    @profiled("predict")
     def predict(self):
-        self.score = Model(self.dataframe).predict(self.dataframe)
-
+        self.model = Model(self.dataframe, fast=self.fast, previous=self.model, n_jobs=self.n_jobs,
+                           max_samples=self.max_samples)
+        self.score = self.model.predict(self.dataframe)
+
+    def tracks(self, columns=None):
+        """
+        Compact store of the grouped cells; columns to include, all if None
+        Sorting and improvement change the ID of single rows in place, which would re-sort and copy every column
+        of a store ordered by ID; the store is built from the dataframe once the grouping is final
+        """
+        return TrackStore(self.dataframe, columns)
+
+    @profiled("get_results")
     def get_results(self, brownian_1sec=1.6):
-        brownian = brownian_1sec * pl.pi**pl.log10(self.dataframe.Time.max())
-        for cell_ID in list(set(self.dataframe.ID.values)):
-            if cell_ID == -1:
-                continue
-
-            cell_group = self.dataframe[self.dataframe.ID == cell_ID].copy()
-            # calculate rotation/frequency
-            get_frequency(cell_group)
-
-            # skip cells that don't spin
-            if cell_group.Rotation_cum.max() - cell_group.Rotation_cum.min() < brownian*180/pl.pi:
+        brownian = brownian_1sec * np.pi**np.log10(self.dataframe.Time.max())
+        # calculate rotation/frequency of all cells at once, on the needed columns only
+        store = self.tracks(["Angle", "Time", "Major"])
+        cells = store.frame()
+        get_frequency(cells, by="ID")
+        store.add("Rotation_cum", cells.Rotation_cum.values, "float64")
+        store.add("Frequency", cells.Frequency.values, "float64")
+        grouped = cells.groupby("ID", sort=True)
+
+        # skip cells that don't spin
+        spin_range = grouped.Rotation_cum.max() - grouped.Rotation_cum.min()
+        spinning = ~(spin_range < brownian*180/np.pi)
+        # mean non-stationary frequency
+        freq_mean = cells.Frequency.where(cells.Frequency > 0.1).groupby(cells.ID).mean()
+        size = grouped.Major.quantile(0.9)*self.px_to_m
+
+        for cell in store:
+            if not spinning[cell.ID]:
                 continue
+            frequency = cell["Frequency"]
 
-            self.results.time += cell_group.Time,
-            self.results.rotation_cum += cell_group.Rotation_cum,
+            self.results.ids += int(cell.ID),
+            self.results.time += cell["Time"],
+            self.results.rotation_cum += cell["Rotation_cum"],
 
             # gather data points to be plotted together in a boxplot
-            self.results.box_plot += cell_group.Frequency.dropna(),
-            # gather mean non-stationary frequency to a list
-            self.results.freq += cell_group.Frequency,
-            self.results.freq_mean += cell_group.loc[cell_group.Frequency > 0.1, "Frequency"].mean(),
-            self.results.size += cell_group.Major.quantile(0.9)*self.px_to_m,
-            self.results.cells_obs += len(cell_group),
+            self.results.box_plot += frequency[~np.isnan(frequency)],
+            self.results.freq += frequency,
+            self.results.freq_mean += freq_mean[cell.ID],
+            self.results.size += size[cell.ID],
+            self.results.cells_obs += int(len(cell)),
             self.results.cells_max += self.slices,
 
-    def plot_map(self):
-        pl.figure()
-        pl.scatter(self.dataframe.X, self.dataframe.Y, s=3, c=self.dataframe.ID, cmap="Set1")
-        pl.xlim(0, self.dataframe.X.max() * 1.02)
-        pl.ylim(self.dataframe.Y.max() * 1.02, 0)
-        for cell_ID in list(set(self.dataframe.ID.values)):
-            if cell_ID == -1:
-                continue
-            pl.annotate("n=" + str(len(self.dataframe[self.dataframe.ID == cell_ID])) + "\n",
-                        (self.dataframe.loc[self.dataframe.ID == cell_ID, "X"].mean(),
-                         self.dataframe.loc[self.dataframe.ID == cell_ID, "Y"].mean()),
-                        fontsize=8,
-                        ha="center")
-        pl.show()
-
-    def plot_rotation_cum(self):
-        pl.figure()
-        for i in range(len(self.results.time)):
-            pl.scatter(self.results.time[i], self.results.rotation_cum[i], s=3)
-            pl.plot(self.results.time[i], self.results.rotation_cum[i])
-        pl.show()
-
-    def plot_boxplot(self):
-        # create empty figure and axis object
-        fig, ax = pl.subplots()
-        # create another empty axis object with shared x axis
-        ax2 = ax.twinx()
-
-        # boxplot
-        ax.boxplot(self.results.box_plot, showfliers=False)
-
-        # overlay stuff to boxplots
-        for cell_index in range(len(self.results.box_plot)):
-            # individual datapoints
-            y = self.results.box_plot[cell_index]
-            # random jitter
-            x = [random.gauss(1 + cell_index, 0.04) for _ in range(len(y))]
-            ax.plot(x, y, 'k.', markersize=1)
-
-            # add means
-            ax.plot(cell_index + 0.90, self.results.freq_mean[cell_index], marker=5, color="tab:blue")
-            ax.set(ylabel="Frequency (1/s)", xlabel="Individual cells")
-            ax.yaxis.label.set_color("tab:blue")
-            ax.tick_params(axis="y", labelcolor="tab:blue")
-            pl.xticks([i + 1 for i in range(len(self.results.box_plot))],
-                      ["n=" + str(self.results.cells_obs[i]) + "\n   /" + str(self.results.cells_max[i])
-                       for i in range(len(self.results.box_plot))])
-            ax.tick_params(axis="x", labelsize=8)
-
-            # add cell size
-            ax2.plot(cell_index + 1.1, self.results.size[cell_index]*1e6, marker=4, color="tab:red")
-            ax2.set(ylabel="Cell size (um)")
-            ax2.yaxis.label.set_color("tab:red")
-            ax2.tick_params(axis="y", labelcolor="tab:red")
-
-        p1, = ax.plot([1], [-1], 'k.', markersize=1)
-        p2 = pl.scatter([1], [-1], marker=5, color="tab:blue")
-        p3 = pl.scatter([1], [-1], marker=8, color="tab:red")
-        ax.legend([p1, p2, p3],
-                  ["Frequency datapoints", "Mean motile frequency", "Cell size"],
-                  bbox_to_anchor=(-0.02, 1.01, 1, 1),
-                  loc='lower left',
-                  mode="expand",
-                  handletextpad=0.05,
-                  ncol=3,
-                  borderaxespad=0,
-                  frameon=False)
-
-        # exclude outliers from graph
-        flat_list = [item for sublist in self.results.box_plot for item in sublist]
-        y_max = max(pl.quantile(flat_list, 0.99), pl.mean(flat_list) + 4 * pl.std(flat_list))
-
-        ax.set_ylim(0, y_max)
-        ax2.set_ylim(bottom=0)
-        fig.suptitle("EK01 PoXeR spinning frequency RDM", fontsize=14)
-        pl.show()
+    def plot_map(self, path=None, **kwargs):
+        plot.plot_map(self, path, **kwargs)
+
+    def plot_rotation_cum(self, path=None, **kwargs):
+        plot.plot_rotation_cum(self, path, **kwargs)
+
+    def plot_boxplot(self, path=None, **kwargs):
+        plot.plot_boxplot(self, path, **kwargs)
 
 
 class Results:
     def __init__(self):
+        self.ids = []
         self.box_plot = []
         self.freq = []
         self.freq_mean = []
@@ -0,0 +1,202 @@
+"""
+Detect cells in an image series without ImageJ
+Follows analyse-cells-timelapse.ijm: despeckle, default threshold, analyze particles and measure
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+from scipy import ndimage
+import tifffile
+from src.util import num_sorted
+
+COLUMNS = [" ", "Area", "Mean", "Min", "Max", "X", "Y", "Major", "Minor", "Angle", "Slice"]
+
+
+def read_frame(path):
+    """Memory-map an uncompressed image, otherwise read it"""
+    try:
+        return tifffile.memmap(path, mode="r")
+    except ValueError:
+        return tifffile.imread(path)
+
+
+def histogram(image):
+    """
+    Input: image
+    Output: 256-bin histogram, lowest value, bin width
+    """
+    if image.dtype == np.uint8:
+        return np.bincount(image.ravel(), minlength=256), 0, 1
+    low, high = float(image.min()), float(image.max())
+    width = (high - low) / 256 or 1
+    bins = np.clip(((image - low) / width).astype(int), 0, 255)
+    return np.bincount(bins.ravel(), minlength=256), low, width
+
+
+def default_threshold(hist):
+    """ImageJ "Default" threshold, a variation of the IsoData method; returns a histogram bin"""
+    data = hist.astype(float)
+    data[0] = data[-1] = 0  # saturated pixels are ignored
+    nonzero = np.flatnonzero(data)
+    if len(nonzero) < 2:
+        return len(data) // 2
+    low, high = nonzero[0], nonzero[-1]
+
+    index = np.arange(len(data))
+    cum_count = np.cumsum(data)
+    cum_sum = np.cumsum(index * data)
+    moving = low
+    while True:
+        below = cum_sum[moving] / cum_count[moving]
+        above = (cum_sum[high] - cum_sum[moving]) / (cum_count[high] - cum_count[moving])
+        result = (below + above) / 2
+        moving += 1
+        if not (moving + 1 <= result and moving < high - 1):
+            return int(round(result))
+
+
+def measure(image, labels, n):
+    """
+    Input: original image, label image, number of labels
+    Output: dataframe of ImageJ-style measurements of each label
+    """
+    rows, cols = np.nonzero(labels)
+    ind = labels[rows, cols]
+    values = image[rows, cols].astype(float)
+    # pixel centres
+    x, y = cols + 0.5, rows + 0.5
+
+    area = np.bincount(ind, minlength=n + 1)[1:].astype(float)
+    x_mean = np.bincount(ind, x, n + 1)[1:] / area
+    y_mean = np.bincount(ind, y, n + 1)[1:] / area
+    dx, dy = x - x_mean[ind - 1], y - y_mean[ind - 1]
+    # second moments, including the extent of each pixel
+    u20 = np.bincount(ind, dx * dx, n + 1)[1:] / area + 1 / 12
+    u02 = np.bincount(ind, dy * dy, n + 1)[1:] / area + 1 / 12
+    u11 = np.bincount(ind, dx * dy, n + 1)[1:] / area
+
+    # ellipse with the same moments, scaled to the same area
+    common = np.sqrt((u20 - u02) ** 2 + 4 * u11 ** 2)
+    major = 4 * np.sqrt((u20 + u02 + common) / 2)
+    minor = 4 * np.sqrt(np.maximum((u20 + u02 - common) / 2, 0))
+    scale = np.sqrt(area / (np.pi * major * minor / 4))
+    # degrees counterclockwise from the x axis, with y pointing up
+    angle = np.degrees(-0.5 * np.arctan2(2 * u11, u20 - u02)) % 180
+
+    return pd.DataFrame({
+        "Area": area,
+        "Mean": np.bincount(ind, values, n + 1)[1:] / area,
+        "Min": ndimage.minimum(image, labels, np.arange(1, n + 1)),
+        "Max": ndimage.maximum(image, labels, np.arange(1, n + 1)),
+        "X": x_mean,
+        "Y": y_mean,
+        "Major": major * scale,
+        "Minor": minor * scale,
+        "Angle": angle})
+
+
+def perimeter(labels, n):
+    """
+    Traced perimeter of each label as in ImageJ: outline length with corners cut diagonally
+    ImageJ cuts every corner after a side longer than 1 px and every other corner on staircases;
+    corners between two 1 px sides are counted as half a corner here, between a short and a long side as 3/4
+    """
+    padded = np.pad(labels, 1)
+    # exposed pixel edges
+    edges = np.zeros(n + 1)
+    for a, b in [(padded[:-1], padded[1:]), (padded[:, :-1], padded[:, 1:])]:
+        edge = a != b
+        edges += np.bincount(a[edge], minlength=n + 1) + np.bincount(b[edge], minlength=n + 1)
+
+    # outline vertices from 2x2 windows; 8-connected labels never share a window
+    window = np.stack([padded[:-1, :-1], padded[:-1, 1:], padded[1:, :-1], padded[1:, 1:]])
+    label = window.max(axis=0)
+    inside = window == label
+    count = inside.sum(axis=0)
+    vertex = (count == 1) | (count == 3)
+    diagonal = (count == 2) & (inside[0] == inside[3])
+
+    # the pixel that differs from the others points along the two sides of a vertex
+    odd = np.argmax(inside != (count == 3), axis=0)
+    up, left = odd < 2, odd % 2 == 0
+    padded_vertex = np.pad(vertex, 1)
+    rows, cols = np.indices(vertex.shape) + 1
+    short_vertical = padded_vertex[np.where(up, rows - 1, rows + 1), cols]
+    short_horizontal = padded_vertex[rows, np.where(left, cols - 1, cols + 1)]
+    weight = vertex * (1 - 0.25 * (short_vertical.astype(int) + short_horizontal)) + 2 * diagonal
+
+    corners = np.bincount(label.ravel(), weight.ravel(), n + 1)
+    return (edges - corners * (2 - np.sqrt(2)))[1:]
+
+
+def detect_frame(path, dark=False, size=(50, 200), circularity=(0.0, 0.8)):
+    """
+    Input:
+        path: image file path
+        dark: cells are bright on a dark background
+        size: range of particle areas; px
+        circularity: range of particle circularity
+    Output: dataframe of measurements of the particles in the image
+    """
+    image = read_frame(path)
+    # despeckle
+    working = ndimage.median_filter(np.asarray(image), size=3, mode="nearest")
+
+    hist, low, width = histogram(working)
+    level = low + (default_threshold(hist) + 1) * width
+    mask = working >= level if dark else working < level
+
+    labels, n = ndimage.label(mask, structure=np.ones((3, 3)))
+    if n == 0:
+        # typed empty frame, so that concatenated results keep float columns
+        return measure(image, np.zeros_like(labels), 0)
+
+    # exclude particles on edges
+    edge = np.unique(np.concatenate([labels[0], labels[-1], labels[:, 0], labels[:, -1]]))
+    area = np.bincount(labels.ravel(), minlength=n + 1).astype(float)
+    circ = np.minimum(4 * np.pi * area[1:] / perimeter(labels, n) ** 2, 1)
+    keep = (area[1:] >= size[0]) & (area[1:] <= size[1]) & (circ >= circularity[0]) & (circ <= circularity[1])
+    keep[edge[edge > 0] - 1] = False
+
+    # relabel kept particles in order
+    lookup = np.zeros(n + 1, dtype=labels.dtype)
+    lookup[1:][keep] = np.arange(1, keep.sum() + 1)
+    return measure(image, lookup[labels], int(keep.sum()))
+
+
+def _detect_chunk(paths, **kwargs):
+    return [detect_frame(path, **kwargs) for path in paths]
+
+
+def detect(images, workers=None, chunk=16, **kwargs):
+    """
+    Input:
+        images: list of image file paths of one series
+        workers: number of threads; frames are processed in chunks
+        chunk: number of frames per task
+        kwargs: passed to detect_frame
+    Output: dataframe in the format of the ImageJ results table
+    """
+    images = num_sorted(images)
+    chunks = [images[i:i + chunk] for i in range(0, len(images), chunk)]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        frames = [frame for frames in executor.map(lambda paths: _detect_chunk(paths, **kwargs), chunks)
+                  for frame in frames]
+
+    for i, frame in enumerate(frames):
+        frame["Slice"] = i + 1
+    results = pd.concat(frames, ignore_index=True)
+    results.insert(0, " ", np.arange(1, len(results) + 1))
+    return results[COLUMNS]
+
+
+def detect_folder(path, **kwargs):
+    """Write Results_<subfolder>.csv for every image series in the subfolders of path"""
+    for sub_folder in num_sorted([i.path for i in os.scandir(path) if i.is_dir()]):
+        images = [os.path.join(sub_folder, i) for i in os.listdir(sub_folder) if i.endswith(".tif")]
+        if not images:
+            continue
+        print(f"Detecting cells in {os.path.basename(sub_folder)}")
+        results = detect(images, **kwargs)
+        results.to_csv(os.path.join(path, f"Results_{os.path.basename(sub_folder)}.csv"), index=False)
@@ -1,38 +1,121 @@
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
 import exifread
+import numpy as np
 import pandas as pd
+from src.profiling import profiled
+
+CACHE_FILE = ".timestamps.json"
+
+
+def read_timestamp(image, subsec=True):
+    """
+    Read only the timestamp tags from the image header
+    Input:
+        image: image file path
+        subsec: also read sub-second EXIF tags, which are stored after DateTime
+    Output: timestamp as "yyyy:mm:dd hh:mm:ss", followed by ".<fraction>" if available
+    """
+    with open(image, "rb") as f:
+        tags = exifread.process_file(f, stop_tag="SubSecTimeOriginal" if subsec else "DateTime",
+                                     details=False, extract_thumbnail=False)
+    # each sub-second tag belongs to its own date tag
+    for date_tag, subsec_tag in (("Image DateTime", "EXIF SubSecTime"),
+                                 ("EXIF DateTimeOriginal", "EXIF SubSecTimeOriginal")):
+        if subsec and date_tag in tags and str(tags.get(subsec_tag, "")).strip().isdigit():
+            return str(tags[date_tag]) + "." + str(tags[subsec_tag]).strip()
+    return str(tags["Image DateTime"])
+
+
+def read_timestamps(images, workers=16, cache=True, subsec=True):
+    """
+    Input:
+        images: list of image file paths
+        workers: number of threads reading image headers
+        cache: use and update a sidecar file of timestamps in the image folder
+        subsec: passed to read_timestamp
+    Output: list of timestamps as returned by read_timestamp
+    """
+    cache_path = os.path.join(os.path.dirname(images[0]), CACHE_FILE) if images else None
+    cached = {}
+    if cache and cache_path and os.path.exists(cache_path):
+        with open(cache_path) as f:
+            cached = json.load(f)
+
+    # entries are only valid for unchanged files read with the same tags
+    tags = "DateTime SubSecTime" if subsec else "DateTime"
+    keys = []
+    for image in images:
+        stat = os.stat(image)
+        keys += [os.path.abspath(image), stat.st_size, stat.st_mtime, tags],
+    missing = [i for i, key in enumerate(keys) if cached.get(key[0], [None])[:3] != key[1:]]
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for i, time in zip(missing, executor.map(lambda image: read_timestamp(image, subsec),
+                                                 [images[i] for i in missing])):
+            cached[keys[i][0]] = keys[i][1:] + [time]
+
+    if cache and cache_path and missing:
+        try:
+            with open(cache_path, "w") as f:
+                json.dump(cached, f)
+        except OSError:  # read-only image folder
+            pass
+
+    return [cached[key[0]][3] for key in keys]
 
 
 class Fps:
-    def __init__(self, images):
-        timestamps = pd.DataFrame([
-            [str(exifread.process_file(open(images[i], "rb"))["Image DateTime"]),  # Times
-             int(images[i].replace(".tif", "").split("-")[-1])]  # Slices
-            for i in range(len(images))],
-            columns=["Time", "Slice"])
-        timestamps = timestamps.sort_values("Slice", ignore_index=True).copy()
-        # convert timestamp into seconds, using only hh:mm:ss
-        timestamps["Time"] = timestamps.Time.apply(lambda x:
-                                                   int(x.split(" ")[-1].split(":")[0]) * 3600 +
-                                                   int(x.split(" ")[-1].split(":")[1]) * 60 +
-                                                   int(x.split(" ")[-1].split(":")[2]))
+    """
+    Reconstruct the time of each slice from image timestamps
+    Sub-second timestamps are used directly; otherwise frames are spread evenly within each second
+    """
+    @profiled("fps")
+    def __init__(self, images, subsec=True):
+        timestamps = pd.DataFrame({
+            "Time": read_timestamps(images, subsec=subsec),
+            "Slice": [int(image.replace(".tif", "").split("-")[-1]) for image in images]})
+        self.set_times(timestamps)
+
+    def set_times(self, timestamps):
+        """
+        Input: dataframe with timestamp strings in Time and image numbers in Slice
+        Output: sets start, values, time_dict and time_array
+        """
+        timestamps = timestamps.sort_values("Slice", ignore_index=True)
+        # convert timestamp into seconds since midnight of the first day
+        date_time = pd.to_datetime(timestamps.Time.str[:19], format="%Y:%m:%d %H:%M:%S")
+        seconds = (date_time - date_time.min().normalize()).dt.total_seconds().values.astype(np.int64)
+        # fraction of a second if the image has a sub-second tag, else nan
+        fraction = np.where(timestamps.Time.str.len().values > 19,
+                            pd.to_numeric("0" + timestamps.Time.str[19:], errors="coerce").values, np.nan)
 
         # count fps for each second
-        fps_df = timestamps.groupby("Time").size().reset_index(name="fps")
-        self.start = timestamps.Time.min() + 1 - min(1, fps_df.iloc[0, 1] / fps_df.iloc[1, 1])
+        fps_df = pd.Series(seconds).value_counts(sort=False).sort_index()
         # for information
-        self.values = fps_df.fps.values[1:-1]
-        # first and last second are not necessarily a full second; use nearest fps if higher
-        if fps_df.iloc[0, 1] < fps_df.iloc[1, 1]:
-            fps_df.iloc[0, 1] = fps_df.iloc[1, 1].copy()
-        if fps_df.iloc[-1, 1] < fps_df.iloc[-2, 1]:
-            fps_df.iloc[-1, 1] = fps_df.iloc[-2, 1].copy()
-
-        # use fps to create a more accurate timestamp, start from 0s
-        fps_series = timestamps.Time.apply(lambda x: fps_df[fps_df.Time == x].fps.sum())
-        timestamps["Time"] = (fps_series.shift(1) ** (-1)).cumsum()
-        timestamps.loc[0, "Time"] = 0
+        self.values = fps_df.values[1:-1]
+
+        # sub-second times are only used if every frame has them, and they are not all zero
+        if not np.isnan(fraction).any() and (fraction > 0).any():
+            time = seconds + fraction
+            self.start = time.min()
+            time = time - time[0]
+        else:
+            fps = fps_df.values.copy()
+            self.start = seconds.min() + 1 - min(1, fps[0] / fps[1])
+            # first and last second are not necessarily a full second; use nearest fps if higher
+            fps[0] = max(fps[0], fps[1])
+            fps[-1] = max(fps[-1], fps[-2])
+
+            # use fps to create a more accurate timestamp, start from 0s
+            fps_series = fps[np.searchsorted(fps_df.index.values, seconds)]
+            time = np.concatenate([[0], np.cumsum(1 / fps_series[:-1])])
+
         # convert slice to start from 1 if not already
-        timestamps.Slice = timestamps.Slice - timestamps.Slice.min() + 1
+        slices = timestamps.Slice.values - timestamps.Slice.min() + 1
 
-        # Dictionary slice: time
-        self.time_dict = timestamps.set_index("Slice").to_dict()["Time"]
+        # slice: time
+        self.time_dict = dict(zip(slices.tolist(), time.tolist()))
+        self.time_array = np.full(slices.max() + 1, np.nan)
+        self.time_array[slices] = time
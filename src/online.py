@@ -0,0 +1,218 @@
+"""
+Track cells while a recording is being acquired
+Detections are consumed slice by slice; only a bounded window of recent frames is kept per track
+"""
+import io
+import os
+import time
+from collections import deque
+from src.util import *
+
+
+class OnlineTracker:
+    """
+    Input:
+        limit: proximity filter; px, estimated from the first batch if None
+        max_size: size filter; px, estimated from the first batch if None
+        window: number of frames kept per track
+        max_gap: number of slices after which an unseen track is dropped
+        min_track: number of frames before a track is reported
+        fps: frame rate used for the time of each slice if detections have no Time column
+    """
+    def __init__(self, limit=None, max_size=None, window=250, max_gap=50, min_track=10, fps=None):
+        self.tracker = None
+        self.limit = limit
+        self.max_size = max_size
+        self.window = window
+        self.max_gap = max_gap
+        self.min_track = min_track
+        self.fps = fps
+        self.ids = np.zeros(0, dtype=int)  # ID of each track of the tracker
+        self.last_seen = np.zeros(0, dtype=int)
+        self.next_id = 0
+        self.frames = {}  # ID: deque of recent rows
+        self.emitted = {}  # ID: (last reported slice, Rotation_cum at that slice)
+
+    def _start(self, detections):
+        length = detections.Major.quantile(0.9)  # Cell length without risking outliers
+        self.limit = self.limit or length
+        self.max_size = self.max_size or 1.3 * detections.Major.quantile(0.5)
+        self.tracker = Tracker(self.limit, self.max_size, self.max_gap)
+
+    def _link(self, slc, cells):
+        labels = self.tracker.update(cells[["X", "Y"]].values, cells.Major.values, slc=slc)
+        new = len(self.tracker.count) - len(self.ids)
+        self.ids = np.append(self.ids, np.arange(self.next_id, self.next_id + new))
+        self.last_seen = np.append(self.last_seen, np.zeros(new, dtype=int))
+        self.next_id += new
+        self.last_seen[labels] = slc
+
+        ids = self.ids[labels]
+        for cell_ID, row in zip(ids, cells[["Slice", "Time", "Angle", "X", "Y", "Major", "Minor"]].values):
+            if cell_ID not in self.frames:
+                self.frames[cell_ID] = deque(maxlen=self.window)
+            self.frames[cell_ID].append(row)
+        return set(ids)
+
+    def _prune(self, slc):
+        """Forget tracks that have not been seen for max_gap slices"""
+        keep = self.last_seen >= slc - self.max_gap
+        if keep.all():
+            return
+        for cell_ID in self.ids[~keep]:
+            self.frames.pop(cell_ID, None)
+            self.emitted.pop(cell_ID, None)
+        self.tracker.retire(keep)
+        self.ids = self.ids[keep]
+        self.last_seen = self.last_seen[keep]
+
+    def _report(self, cell_IDs):
+        """Rotation and frequency of the frames of tracks whose centred filter window is complete"""
+        columns = ["Slice", "Time", "Angle", "X", "Y", "Major", "Minor"]
+        cells = pd.DataFrame(np.concatenate([np.array(self.frames[cell_ID]) for cell_ID in cell_IDs]), columns=columns)
+        cells.insert(0, "ID", np.repeat(cell_IDs, [len(self.frames[cell_ID]) for cell_ID in cell_IDs]))
+        get_frequency(cells, by="ID")
+        # the last two frames of each track still change when more frames arrive
+        cells = cells[cells.groupby("ID").cumcount(ascending=False) >= 2]
+
+        # continue the cumulative rotation from the last report
+        emitted = pd.DataFrame.from_dict(self.emitted, orient="index", columns=["Slice", "Rotation_cum"])
+        last_slice = cells.ID.map(emitted.Slice)
+        anchor = cells[cells.Slice == last_slice].set_index("ID").Rotation_cum
+        cells["Rotation_cum"] += cells.ID.map(emitted.Rotation_cum - anchor).fillna(0)
+        cells = cells[~(cells.Slice <= last_slice)]
+
+        last = cells.groupby("ID").tail(1)
+        self.emitted.update(zip(last.ID, zip(last.Slice, last.Rotation_cum)))
+        return cells.reset_index(drop=True)
+
+    def update(self, detections):
+        """
+        Input: dataframe of detections of one or more new slices, in the format of the ImageJ results
+        Output: dataframe of new per-frame Rotation, Rotation_cum and Frequency of established tracks
+        """
+        if len(detections) == 0:
+            return pd.DataFrame()
+        detections = detections.copy()
+        detections["Angle"] = 180 - detections.Angle
+        if "Time" not in detections:
+            detections["Time"] = (detections.Slice - 1) / self.fps
+        if self.tracker is None:
+            self._start(detections)
+
+        updated = set()
+        for slc, cells in detections.groupby("Slice", sort=True):
+            updated |= self._link(slc, cells)
+            self._prune(slc)
+
+        established = [cell_ID for cell_ID in sorted(updated)
+                       if cell_ID in self.frames and len(self.frames[cell_ID]) >= self.min_track]
+        return self._report(established) if established else pd.DataFrame()
+
+
+def follow_csv(path, batch=1, poll=1.0, timeout=60):
+    """
+    Input:
+        path: csv file that is being written
+        batch: number of complete slices per yielded dataframe
+        poll: seconds between checks for new rows
+        timeout: stop after this many seconds without new rows
+    Output: generator of dataframes of complete slices
+    """
+    header = None
+    rest = ""
+    pending = pd.DataFrame()
+    offset = 0
+    idle = 0
+    while True:
+        with open(path) as f:
+            f.seek(offset)
+            text = f.read()
+            offset = f.tell()
+        if text:
+            idle = 0
+            lines = (rest + text).split("\n")
+            rest = lines.pop()  # incomplete last line
+            if header is None and lines:
+                # the header is only used once it is complete
+                header, lines = lines[0], lines[1:]
+            if lines:
+                rows = pd.read_csv(io.StringIO("\n".join([header] + lines)))
+                pending = pd.concat([pending, rows], ignore_index=True)
+        else:
+            idle += poll
+            if idle >= timeout:
+                # the recording ended; the last slice is complete
+                if len(pending):
+                    yield pending
+                return
+            time.sleep(poll)
+
+        # the latest slice may still receive rows
+        slices = np.sort(pending.Slice.unique()) if len(pending) else []
+        while len(slices) > batch:
+            ready = pending.Slice <= slices[batch - 1]
+            yield pending[ready]
+            pending = pending[~ready]
+            slices = slices[batch:]
+
+
+def follow_folder(path, batch=1, poll=1.0, timeout=60, **kwargs):
+    """
+    Input:
+        path: folder that the microscope writes images to
+        batch: number of images per yielded dataframe
+        poll: seconds between checks for new images
+        timeout: stop after this many seconds without new images
+        kwargs: passed to detect.detect_frame
+    Output: generator of dataframes of detections
+    """
+    from src.detect import detect_frame
+    done = set()
+    idle = 0
+    while True:
+        images = num_sorted([i for i in os.listdir(path) if i.endswith(".tif") and i not in done])
+        # the newest image may still be written
+        ready = images[:-1] if idle < timeout else images
+        if len(ready) >= batch or (ready and idle >= timeout):
+            idle = 0
+            frames = []
+            for image in ready[:batch]:
+                frame = detect_frame(os.path.join(path, image), **kwargs)
+                frame["Slice"] = int(image.replace(".tif", "").split("-")[-1])
+                frames += frame,
+                done.add(image)
+            yield pd.concat(frames, ignore_index=True)
+        elif idle >= timeout:
+            return
+        else:
+            idle += poll
+            time.sleep(poll)
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Report cell rotation while a recording is acquired")
+    parser.add_argument("source", help="growing ImageJ results csv file, or folder the images are written to")
+    parser.add_argument("--fps", type=float, required=True, help="frame rate of the recording")
+    parser.add_argument("--batch", type=int, default=10, help="number of slices processed at once")
+    parser.add_argument("--window", type=int, default=250, help="number of frames kept per track")
+    parser.add_argument("--timeout", type=float, default=60, help="seconds without new data before stopping")
+    args = parser.parse_args()
+
+    if os.path.isdir(args.source):
+        source = follow_folder(args.source, batch=args.batch, timeout=args.timeout)
+    else:
+        source = follow_csv(args.source, batch=args.batch, timeout=args.timeout)
+    tracker = OnlineTracker(window=args.window, fps=args.fps)
+    for detections in source:
+        report = tracker.update(detections)
+        if len(report) == 0:
+            continue
+        summary = report.groupby("ID").agg(Slice=("Slice", "max"), Frequency=("Frequency", "mean"))
+        print(f"Slice {int(report.Slice.max())}: " +
+              ", ".join(f"cell {cell_ID} {row.Frequency:.2f}/s" for cell_ID, row in summary.iterrows()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""
+Figures of tracked cells and their rotation
+Each figure is drawn with a few collection calls, so that thousands of tracks stay fast to render
+"""
+import numpy as np
+
+
+def show(path=None, dpi=150):
+    """Show the current figure, or save it to path (e.g. .png or .svg) and close it"""
+    import pylab as pl
+    if path:
+        pl.savefig(path, dpi=dpi)
+        pl.close()
+    else:
+        pl.show()
+
+
+def cell_colors(n):
+    """Colors of the default color cycle for n cells"""
+    import pylab as pl
+    colors = pl.rcParams["axes.prop_cycle"].by_key()["color"]
+    return [colors[i % len(colors)] for i in range(n)]
+
+
+def concat(series_list):
+    """Concatenate a list of series into one array, with the list index of each value"""
+    if len(series_list) == 0:
+        return np.zeros(0), np.zeros(0, dtype=int)
+    lengths = [len(series) for series in series_list]
+    return np.concatenate([np.asarray(series, dtype=float) for series in series_list]), np.repeat(
+        np.arange(len(series_list)), lengths)
+
+
+def plot_map(data, path=None, max_labels=500, rasterized=False):
+    """
+    Positions of all detections colored by ID, with the number of detections of each cell
+    Input:
+        data: Data object
+        max_labels: cells are only labelled if there are at most this many
+        rasterized: rasterize the points when saving to a vector format
+    """
+    import pylab as pl
+    df = data.dataframe
+    fig, ax = pl.subplots()
+    ax.scatter(df.X.values, df.Y.values, s=3, c=df.ID.values, cmap="Set1", rasterized=rasterized)
+    ax.set_xlim(0, df.X.max() * 1.02)
+    ax.set_ylim(df.Y.max() * 1.02, 0)
+
+    cells = df[df.ID != -1].groupby("ID").agg(X=("X", "mean"), Y=("Y", "mean"), n=("X", "size"))
+    if len(cells) <= max_labels:
+        for x, y, n in zip(cells.X.values, cells.Y.values, cells.n.values):
+            ax.annotate(f"n={n}\n", (x, y), fontsize=8, ha="center")
+    show(path)
+
+
+def plot_rotation_cum(data, path=None, rasterized=False):
+    """Cumulative rotation of every spinning cell over time"""
+    import pylab as pl
+    from matplotlib.collections import LineCollection
+    results = data.results
+    fig, ax = pl.subplots()
+    colors = cell_colors(len(results.time))
+
+    lines = [np.column_stack([np.asarray(time, dtype=float), np.asarray(rotation, dtype=float)])
+             for time, rotation in zip(results.time, results.rotation_cum)]
+    ax.add_collection(LineCollection(lines, colors=colors, rasterized=rasterized))
+    time, cell = concat(results.time)
+    rotation, _ = concat(results.rotation_cum)
+    ax.scatter(time, rotation, s=3, c=np.array(colors)[cell] if len(cell) else None, rasterized=rasterized)
+    ax.autoscale()
+    show(path)
+
+
+def plot_boxplot(data, path=None, rasterized=False, title="EK01 PoXeR spinning frequency RDM"):
+    """Frequency distribution, mean motile frequency and size of every spinning cell"""
+    import pylab as pl
+    results = data.results
+    n = len(results.box_plot)
+    # create empty figure and axis object
+    fig, ax = pl.subplots()
+    # create another empty axis object with shared x axis
+    ax2 = ax.twinx()
+
+    # boxplot
+    ax.boxplot(results.box_plot, showfliers=False)
+
+    # individual datapoints with random jitter
+    y, cell = concat(results.box_plot)
+    x = np.random.normal(1 + cell, 0.04)
+    ax.plot(x, y, 'k.', markersize=1, rasterized=rasterized)
+
+    # add means
+    ax.plot(np.arange(n) + 0.90, results.freq_mean, linestyle="", marker=5, color="tab:blue")
+    ax.set(ylabel="Frequency (1/s)", xlabel="Individual cells")
+    ax.yaxis.label.set_color("tab:blue")
+    ax.tick_params(axis="y", labelcolor="tab:blue")
+    ax.set_xticks(np.arange(1, n + 1))
+    ax.set_xticklabels([f"n={obs}\n   /{obs_max}" for obs, obs_max in zip(results.cells_obs, results.cells_max)])
+    ax.tick_params(axis="x", labelsize=8)
+
+    # add cell size
+    ax2.plot(np.arange(n) + 1.1, np.array(results.size) * 1e6, linestyle="", marker=4, color="tab:red")
+    ax2.set(ylabel="Cell size (um)")
+    ax2.yaxis.label.set_color("tab:red")
+    ax2.tick_params(axis="y", labelcolor="tab:red")
+
+    p1, = ax.plot([1], [-1], 'k.', markersize=1)
+    p2 = ax.scatter([1], [-1], marker=5, color="tab:blue")
+    p3 = ax.scatter([1], [-1], marker=8, color="tab:red")
+    ax.legend([p1, p2, p3],
+              ["Frequency datapoints", "Mean motile frequency", "Cell size"],
+              bbox_to_anchor=(-0.02, 1.01, 1, 1),
+              loc='lower left',
+              mode="expand",
+              handletextpad=0.05,
+              ncol=3,
+              borderaxespad=0,
+              frameon=False)
+
+    # exclude outliers from graph
+    y_max = max(np.quantile(y, 0.99), np.mean(y) + 4 * np.std(y))
+
+    ax.set_ylim(0, y_max)
+    ax2.set_ylim(bottom=0)
+    fig.suptitle(title, fontsize=14)
+    show(path)
+
+
+def plot_freq_together(data_list, path=None, rasterized=False):
+    """Frequency of the cells of several samples on a common time axis"""
+    import pylab as pl
+    stamp1 = data_list[0].start_time
+    ratios = [data.get_time_range()[1] - data.get_time_range()[0] for data in data_list]
+    time_span = sum(ratios)
+    interval = round(time_span/8, 0) if time_span >= 8 else 1 / round(8/time_span)
+    fig, ax = pl.subplots(1, len(data_list), gridspec_kw={"width_ratios": ratios}, squeeze=False)
+    ax = ax[0]
+    frequencies = []
+    for i, data in enumerate(data_list):
+        dt = data.start_time - stamp1
+        times, cell = concat(data.results.time)
+        freq, _ = concat(data.results.freq)
+        frequencies += freq[~np.isnan(freq)],
+        if len(times) == 0:
+            continue
+        colors = np.array(cell_colors(len(data.results.time)))
+        ax[i].scatter(times + dt, freq, s=3, c=colors[cell], rasterized=rasterized)
+
+        x_ticks = np.arange(int(dt/interval)*interval, dt+ratios[i], interval)
+        ax[i].set_xticks(x_ticks[(x_ticks >= times.min() + dt) & (x_ticks < times.max() + dt)])
+    for i in range(len(data_list)):
+        if i != 0:
+            ax[i].spines["left"].set_visible(False)
+            ax[i].set_yticks([])
+        if i < len(data_list) - 1:
+            ax[i].spines["right"].set_visible(False)
+    pl.subplots_adjust(wspace=0.1)
+    pl.setp(ax, ylim=(0, np.quantile(np.concatenate(frequencies), 0.98)))
+    show(path)
@@ -0,0 +1,120 @@
+"""Timing, memory and counter instrumentation of pipeline stages"""
+import contextlib
+import cProfile
+import csv
+import functools
+import json
+import time
+import tracemalloc
+
+
+class Profiler:
+    """Collect per-stage timings and per-round counters of one sample"""
+    def __init__(self):
+        self.enabled = False
+        self.memory = False
+        self.stages = []
+        self.counters = {}
+        self.cprofile = None
+        self._peaks = []
+        self._tracing = False  # tracemalloc was started by this profiler
+
+    def enable(self, memory=False, cprofile=False):
+        """
+        Input:
+            memory: track peak memory of each stage with tracemalloc
+            cprofile: run cProfile over everything until the report is saved
+        """
+        self.reset()
+        self.enabled = True
+        self.memory = memory
+        if memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._tracing = True
+        if cprofile:
+            self.cprofile = cProfile.Profile()
+            self.cprofile.enable()
+
+    def disable(self):
+        if self.cprofile:
+            self.cprofile.disable()
+        if self._tracing:
+            tracemalloc.stop()
+            self._tracing = False
+        self.enabled = False
+        self.memory = False
+
+    def reset(self):
+        self.stages = []
+        self.counters = {}
+        self.cprofile = None
+        self._peaks = []
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Time a stage; nested stages are recorded separately"""
+        if not self.enabled:
+            yield
+            return
+
+        if self.memory:
+            # tracemalloc has a single peak; enclosing stages keep the highest peak of their nested stages
+            current, peak = tracemalloc.get_traced_memory()
+            if self._peaks:
+                self._peaks[-1][1] = max(self._peaks[-1][1], peak)
+            tracemalloc.reset_peak()
+            self._peaks += [current, 0],
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            record = {"stage": name, "seconds": time.perf_counter() - start}
+            if self.memory:
+                start_memory, peak = self._peaks.pop()
+                peak = max(peak, tracemalloc.get_traced_memory()[1])
+                record["peak_mb"] = (peak - start_memory) / 2**20
+                if self._peaks:
+                    self._peaks[-1][1] = max(self._peaks[-1][1], peak)
+            self.stages += record,
+
+    def count(self, name, value):
+        """Add a value to a counter; each call is one round"""
+        if self.enabled:
+            self.counters.setdefault(name, []).append(value)
+
+    def report(self):
+        return {"stages": self.stages, "counters": self.counters}
+
+    def save(self, path):
+        """
+        Write the report as json, or as csv if path ends with .csv
+        The csv has a row per stage followed by a row per counter value and round
+        A cProfile dump is written next to it as <path>.prof
+        """
+        if path.endswith(".csv"):
+            with open(path, "w", newline="") as f:
+                writer = csv.DictWriter(f, fieldnames=["stage", "seconds", "peak_mb", "counter", "round", "value"])
+                writer.writeheader()
+                writer.writerows(self.stages)
+                writer.writerows({"counter": name, "round": i + 1, "value": value}
+                                 for name, values in self.counters.items() for i, value in enumerate(values))
+        else:
+            with open(path, "w") as f:
+                json.dump(self.report(), f, indent=2, default=float)
+        if self.cprofile:
+            self.cprofile.disable()
+            self.cprofile.dump_stats(path + ".prof")
+
+
+profiler = Profiler()
+
+
+def profiled(name):
+    """Decorator to time a function as a stage of the global profiler"""
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with profiler.stage(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,90 @@
+"""Persistent store of the results of many experiments"""
+import sqlite3
+import numpy as np
+import pandas as pd
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS frames (
+    experiment TEXT, sample TEXT, cell INTEGER, start_time REAL,
+    time REAL, rotation_cum REAL, frequency REAL);
+CREATE TABLE IF NOT EXISTS cells (
+    experiment TEXT, sample TEXT, cell INTEGER, start_time REAL,
+    freq_mean REAL, size REAL, cells_obs INTEGER, cells_max INTEGER,
+    PRIMARY KEY (experiment, sample, cell));
+CREATE INDEX IF NOT EXISTS frames_cell ON frames (experiment, sample, cell);
+CREATE INDEX IF NOT EXISTS frames_sample ON frames (sample, cell);
+CREATE INDEX IF NOT EXISTS cells_sample ON cells (sample, cell);
+"""
+
+
+class ResultStore:
+    """
+    SQLite store with a long table of per-frame kinematics and a table of per-cell summaries
+    Input: path to database file
+    """
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def add(self, data, experiment, sample):
+        """Store the results of a processed Data object; replaces earlier results of the same sample"""
+        results = data.results
+        start_time = float(data.start_time) if data.start_time is not None else None
+        frames = pd.DataFrame({
+            "cell": np.repeat(results.ids, [len(time) for time in results.time]).astype(int),
+            "time": np.concatenate([np.asarray(time, dtype=float) for time in results.time] or [[]]),
+            "rotation_cum": np.concatenate([np.asarray(rot, dtype=float) for rot in results.rotation_cum] or [[]]),
+            "frequency": np.concatenate([np.asarray(freq, dtype=float) for freq in results.freq] or [[]])})
+        frames.insert(0, "experiment", experiment)
+        frames.insert(1, "sample", sample)
+        frames.insert(3, "start_time", start_time)
+        cells = pd.DataFrame({
+            "experiment": experiment, "sample": sample, "cell": np.array(results.ids, dtype=int),
+            "start_time": start_time, "freq_mean": results.freq_mean, "size": results.size,
+            "cells_obs": np.array(results.cells_obs, dtype=int), "cells_max": np.array(results.cells_max, dtype=int)})
+
+        with self.connection:
+            for table in ("frames", "cells"):
+                self.connection.execute(f"DELETE FROM {table} WHERE experiment = ? AND sample = ?", (experiment, sample))
+            frames.to_sql("frames", self.connection, if_exists="append", index=False)
+            cells.to_sql("cells", self.connection, if_exists="append", index=False)
+
+    @staticmethod
+    def _where(experiments=None, samples=None, cells=None):
+        conditions, parameters = [], []
+        for column, values in (("experiment", experiments), ("sample", samples), ("cell", cells)):
+            if values is not None:
+                conditions += f"{column} IN ({', '.join('?' * len(values))})",
+                parameters += [int(value) if column == "cell" else value for value in values]
+        return (" WHERE " + " AND ".join(conditions) if conditions else ""), parameters
+
+    def cells(self, experiments=None, samples=None):
+        """Per-cell summaries of the selected experiments and samples"""
+        where, parameters = self._where(experiments, samples)
+        return pd.read_sql(f"SELECT * FROM cells{where}", self.connection, params=parameters)
+
+    def frames(self, experiments=None, samples=None, cells=None):
+        """Per-frame kinematics of the selected experiments, samples and cells"""
+        where, parameters = self._where(experiments, samples, cells)
+        return pd.read_sql(f"SELECT * FROM frames{where}", self.connection, params=parameters)
+
+    def frequency_distribution(self, bin_width=0.1, experiments=None, samples=None, by=("experiment", "sample")):
+        """
+        Histogram of frame frequencies, counted by the database
+        Input:
+            bin_width: width of the frequency bins; 1/s
+            by: columns to count separately
+        Output: dataframe with one row per frequency bin and one column per group
+        """
+        where, parameters = self._where(experiments, samples)
+        where += (" AND" if where else " WHERE") + " frequency IS NOT NULL"
+        groups = ", ".join(by)
+        counts = pd.read_sql(
+            f"SELECT {groups}, CAST(frequency / ? AS INTEGER) AS bin, COUNT(*) AS count "
+            f"FROM frames{where} GROUP BY {groups}, bin",
+            self.connection, params=[bin_width] + parameters)
+        counts["frequency"] = counts.pop("bin") * bin_width
+        return counts.pivot_table(index="frequency", columns=list(by), values="count", fill_value=0).astype(int)
@@ -0,0 +1,87 @@
+"""
+Compact column store of tracked cells
+Rows are sorted by ID and slice, so that every cell is a contiguous slice of each column
+"""
+import numpy as np
+import pandas as pd
+from src.util import COLUMNS
+
+# time is kept in double precision; frequencies are computed from differences of consecutive times
+DTYPES = {**COLUMNS, "Time": "float64"}
+
+
+class Track:
+    """View of the rows of one cell in a TrackStore"""
+    __slots__ = ("store", "ID", "start", "stop")
+
+    def __init__(self, store, ID, start, stop):
+        self.store = store
+        self.ID = ID
+        self.start = start
+        self.stop = stop
+
+    def __len__(self):
+        return self.stop - self.start
+
+    def __getitem__(self, column):
+        """Values of column for this cell; a view, not a copy"""
+        return self.store.columns[column][self.start:self.stop]
+
+
+class TrackStore:
+    """Contiguous float32/int32 columns of cells, with the row offset of each cell"""
+    __slots__ = ("columns", "index", "ids", "offsets")
+
+    def __init__(self, cells, columns=None, unassigned=False):
+        """
+        Input:
+            cells: dataframe with ID and Slice columns
+            columns: columns to store in addition to ID and Slice; all if None
+            unassigned: also store the cells with ID -1
+        """
+        columns = list(cells) if columns is None else columns
+        columns = ["ID", "Slice"] + [column for column in columns if column not in ("ID", "Slice")]
+        ids = cells.ID.values
+        order = np.lexsort((cells.Slice.values, ids))
+        if not unassigned:
+            order = order[ids[order] != -1]
+
+        # original row labels, to write results back to the dataframe
+        self.index = cells.index.values[order]
+        self.columns = {column: np.ascontiguousarray(cells[column].values[order],
+                                                     dtype=DTYPES.get(column, "float32")) for column in columns}
+        self.ids, starts = np.unique(self.columns["ID"], return_index=True)
+        self.offsets = np.append(starts, len(order))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __iter__(self):
+        for i, cell_ID in enumerate(self.ids):
+            yield Track(self, cell_ID, self.offsets[i], self.offsets[i + 1])
+
+    def track(self, cell_ID):
+        i = np.searchsorted(self.ids, cell_ID)
+        if i == len(self.ids) or self.ids[i] != cell_ID:
+            raise KeyError(cell_ID)
+        return Track(self, cell_ID, self.offsets[i], self.offsets[i + 1])
+
+    def sizes(self):
+        """Number of rows of each cell"""
+        return np.diff(self.offsets)
+
+    def add(self, column, values, dtype=None):
+        """Store values in the row order of the store"""
+        self.columns[column] = np.ascontiguousarray(values, dtype=dtype or DTYPES.get(column, "float32"))
+
+    def frame(self, columns=None):
+        """
+        Input: columns to include; all if None
+        Output: dataframe of the stored rows, indexed by their original row labels
+        """
+        columns = list(self.columns) if columns is None else columns
+        return pd.DataFrame({column: self.columns[column] for column in columns}, index=self.index, copy=False)
+
+    @property
+    def nbytes(self):
+        return sum(values.nbytes for values in self.columns.values()) + self.index.nbytes + self.offsets.nbytes
@@ -1,9 +1,10 @@
 """A collection of support functions"""
 import os
 import pandas as pd
-from sklearn.ensemble import RandomForestRegressor
-import pylab as pl
+from numpy.random import Generator, default_rng
+import numpy as np
 import random
+from src.profiling import profiled, profiler
 
 
 def distance(xy1, xy2):
@@ -50,24 +51,220 @@ def group(cells):
     return cells, nearest
 
 
-def load_files(path):
+class Tracker:
+    """Link detections frame to frame to the nearest recently seen track"""
+    features = ("sum_x", "sum_y", "count", "last")  # one value per track
+
+    def __init__(self, limit, max_size, max_gap=50):
+        self.limit = limit  # proximity filter; px
+        self.max_size = max_size  # size filter; px
+        self.max_gap = max_gap  # tracks unseen for more slices are not linked anymore
+        # running sums of the coordinates of each track, the track centre is used as anchor
+        self.sum_x = np.zeros(0)
+        self.sum_y = np.zeros(0)
+        self.count = np.zeros(0)
+        self.last = np.zeros(0)  # last slice of each track
+        self.active = np.zeros(0, dtype=int)  # tracks seen within max_gap slices
+
+    def centres(self, tracks=None):
+        tracks = np.arange(len(self.count)) if tracks is None else tracks
+        return np.column_stack([self.sum_x[tracks] / self.count[tracks], self.sum_y[tracks] / self.count[tracks]])
+
+    def candidates(self, xy, k):
+        """
+        Input: detection coordinates in one slice, maximum number of candidates per detection
+        Output: detection, distance and track of every active track within the proximity filter, nearest first
+        """
+        from scipy.spatial import cKDTree
+
+        k = min(k, len(self.active))
+        dist, ind = cKDTree(self.centres(self.active)).query(xy, k=k, distance_upper_bound=self.limit)
+        dist, ind = dist.reshape(-1, k).ravel(), ind.reshape(-1, k).ravel()
+        detections = np.repeat(np.arange(len(xy)), k)
+        found = np.isfinite(dist)
+        return detections[found], dist[found], self.active[ind[found]]
+
+    def link(self, xy, **features):
+        """
+        Input: array of shape (n, 2) of detection coordinates in one slice
+        Output: track of each detection, -1 if unlinked
+        """
+        labels = np.full(len(xy), -1)
+        if len(self.active) == 0 or len(xy) == 0:
+            return labels
+
+        # candidate tracks near each detection, nearest first
+        detections, dist, ind = self.candidates(xy, 3)
+
+        # greedy assignment, established tracks first; each track and detection used once
+        taken = np.zeros(len(self.count), dtype=bool)
+        for i in np.argsort(dist / np.sqrt(self.count[ind]), kind="stable"):
+            if taken[ind[i]] or labels[detections[i]] != -1:
+                continue
+            taken[ind[i]] = True
+            labels[detections[i]] = ind[i]
+        return labels
+
+    def update(self, xy, major, slc=None, **features):
+        """
+        Input: detection coordinates and lengths in one slice, slice number; other features are used by subclasses
+        Output: track of each detection
+        """
+        if slc is not None:
+            self.active = self.active[slc - self.last[self.active] <= self.max_gap]  # Gap filter
+        labels = self.link(xy, major=major, slc=slc, **features)
+        labels[major > self.max_size] = -1  # Size filter
+
+        # detections that could not be linked start new tracks
+        new = labels == -1
+        labels[new] = np.arange(len(self.count), len(self.count) + new.sum())
+        self.active = np.append(self.active, labels[new])
+        for feature in self.features:
+            setattr(self, feature, np.concatenate([getattr(self, feature), np.zeros(new.sum())]))
+
+        np.add.at(self.sum_x, labels, xy[:, 0])
+        np.add.at(self.sum_y, labels, xy[:, 1])
+        np.add.at(self.count, labels, 1)
+        if slc is not None:
+            self.last[labels] = slc
+        return labels
+
+    def retire(self, keep):
+        """Forget the tracks where keep is False; the remaining tracks are renumbered in order"""
+        for feature in self.features:
+            setattr(self, feature, getattr(self, feature)[keep])
+        self.active = (np.cumsum(keep) - 1)[self.active[keep[self.active]]]
+
+
+class HungarianTracker(Tracker):
+    """
+    Link detections to tracks by optimal assignment between consecutive slices
+    The cost combines distance to the track centre, similarity of Major and Minor and continuity of Angle;
+    tracks missing for up to max_gap slices can still be linked
+    """
+    features = Tracker.features + ("major", "minor", "angle")
+
+    def __init__(self, limit, max_size, max_gap=50):
+        super().__init__(limit, max_size, max_gap)
+        # features of the last detection of each track
+        self.major = np.zeros(0)
+        self.minor = np.zeros(0)
+        self.angle = np.zeros(0)
+
+    def link(self, xy, major=None, minor=None, angle=None, slc=None):
+        labels = np.full(len(xy), -1)
+        if len(self.active) == 0 or len(xy) == 0:
+            return labels
+
+        from scipy.optimize import linear_sum_assignment
+
+        # candidate pairs within the proximity filter, among tracks seen within max_gap slices
+        detections, dist, ind = self.candidates(xy, 5)
+        if len(ind) == 0:
+            return labels
+        gap = slc - self.last[ind]
+
+        d_angle = np.abs(angle[detections] - self.angle[ind]) % 180
+        d_angle = np.minimum(d_angle, 180 - d_angle) / 90
+        cost = (dist / self.limit
+                + np.abs(major[detections] - self.major[ind]) / self.major[ind]
+                + np.abs(minor[detections] - self.minor[ind]) / self.minor[ind]
+                + d_angle / gap  # rotation between frames grows with the gap
+                + 0.1 * (gap - 1)
+                + 1 / np.sqrt(self.count[ind]))  # established tracks first
+
+        # assignment over the tracks that have candidates
+        tracks, columns = np.unique(ind, return_inverse=True)
+        matrix = np.full((len(xy), len(tracks)), 1e6)
+        matrix[detections, columns] = cost
+        rows, cols = linear_sum_assignment(matrix)
+        linked = matrix[rows, cols] < 1e6
+        labels[rows[linked]] = tracks[cols[linked]]
+        return labels
+
+    def update(self, xy, major, minor=None, angle=None, slc=None):
+        labels = super().update(xy, major, minor=minor, angle=angle, slc=slc)
+        self.major[labels], self.minor[labels], self.angle[labels] = major, minor, angle
+        return labels
+
+
+def track(cells, method="kdtree"):
+    """
+    Input:
+        cells: dataframe of unsorted cells
+        method: "kdtree" for greedy nearest-neighbour linking, "hungarian" for optimal assignment
+    Output: list of dataframes of grouped cells
+    """
+    length = cells.Major.quantile(0.9)  # Cell length without risking outliers
+    if method == "hungarian":
+        tracker = HungarianTracker(length, 1.3 * cells.Major.quantile(0.5))
+    else:
+        tracker = Tracker(length, 1.3 * cells.Major.quantile(0.5))
+
+    labels = np.zeros(len(cells), dtype=int)
+    order = np.argsort(cells.Slice.values, kind="stable")
+    slices = cells.Slice.values[order]
+    bounds = np.flatnonzero(np.diff(slices)) + 1
+    xy = cells[["X", "Y"]].values[order]
+    major = cells.Major.values[order]
+    minor = cells.Minor.values[order]
+    angle = cells.Angle.values[order]
+    for rows in np.split(np.arange(len(cells)), bounds):
+        labels[order[rows]] = tracker.update(xy[rows], major[rows], minor=minor[rows], angle=angle[rows],
+                                             slc=slices[rows[0]])
+
+    return [df for _, df in cells.groupby(labels, sort=True)]
+
+
+def find_files(path):
     """
     Input: path to directory
     Output:
-        data: list of dataframes
+        files: list of csv file paths
         images: nested list of image file paths
     """
     files = num_sorted(os.listdir(path))
-    files = [path + "/" + file for file in files if file.endswith(".csv")]
-    data = [pd.read_csv(file) for file in files]
+    # profile reports are written next to the csv files
+    files = [path + "/" + file for file in files if file.endswith(".csv") and not file.endswith(".profile.csv")]
 
     images = [os.path.join(path, i) for i in os.listdir(path) if i.endswith(".tif")]
     for sub_folder in num_sorted([i.path for i in os.scandir(path) if i.is_dir()]):
         images += num_sorted([os.path.join(sub_folder, i) for i in os.listdir(sub_folder) if i.endswith(".tif")]),
 
+    return files, images
+
+
+# columns used from the ImageJ results, with compact types
+COLUMNS = {" ": "int32", "X": "float32", "Y": "float32", "Major": "float32", "Minor": "float32",
+           "Angle": "float32", "Slice": "int32", "Area": "float32", "Mean": "float32", "ID": "int32"}
+
+
+def read_results(file, engine=None):
+    """
+    Input:
+        file: path to csv file
+        engine: pandas csv engine, e.g. "pyarrow"
+    Output: dataframe with only the used columns
+    """
+    header = pd.read_csv(file, nrows=0).columns
+    dtype = {column: COLUMNS[column] for column in header if column in COLUMNS}
+    return pd.read_csv(file, usecols=list(dtype), dtype=dtype, engine=engine)
+
+
+def load_files(path):
+    """
+    Input: path to directory
+    Output:
+        data: list of dataframes
+        images: nested list of image file paths
+    """
+    files, images = find_files(path)
+    data = [read_results(file) for file in files]
+
     return data, images, files
 
 
+@profiled("get_rms")
 def get_rms(data, score):
     # get rms of distance from 1 for groups other than -1
     rms = [score.loc[data[data.ID == int(ID)].index, ID].apply(
@@ -77,27 +274,59 @@ def get_rms(data, score):
     return sum(rms) / len(rms)
 
 
-def get_frequency(cells):
-    cells["Rotation"] = cells["Angle"].diff()
+def get_frequency(cells, by=None):
+    """
+    Input:
+        cells: dataframe of one cell, or of several cells sorted by <by> and then by slice
+        by: column that identifies the cells
+    Output: adds Rotation, Rotation_cum and Frequency columns to cells
+    """
+    groups = cells[by].values if by else np.zeros(len(cells))
+    grouped = cells.groupby(groups, sort=False)
+    position = grouped.cumcount().values
+
+    cells["Rotation"] = grouped["Angle"].diff().astype(float)
     # convert values to fit between -90 and 90 degrees e.g. 179 to -1
     cells.loc[cells.Rotation > 90, "Rotation":] += -180
     cells.loc[cells.Rotation <= -90, "Rotation":] += 180
 
+    # centred 5-frame filter; windows reaching into another cell are discarded
     mode = "mean"
     if mode == "median":
-        med_filter = cells.Rotation.rolling(5).median().shift(-2).copy()
-        cells.loc[med_filter.notna(), "Rotation"] = med_filter[med_filter.notna()].copy()
-    elif mode == "mean":
-        mean_filter = cells.Rotation.rolling(5).mean().shift(-2).copy()
-        cells.loc[mean_filter.notna(), "Rotation"] = mean_filter[mean_filter.notna()].copy()
-    cells["Rotation_cum"] = cells.Rotation.cumsum()
-    cells.iloc[0, cells.columns.get_loc("Rotation_cum")] = 0
+        window_filter = cells.Rotation.rolling(5).median()
+    else:
+        window_filter = cells.Rotation.rolling(5).mean()
+    window_filter[position < 4] = np.nan
+    window_filter = window_filter.groupby(groups, sort=False).shift(-2)
+    cells.loc[window_filter.notna(), "Rotation"] = window_filter[window_filter.notna()]
+
+    cells["Rotation_cum"] = cells.Rotation.groupby(groups, sort=False).cumsum()
+    cells.loc[position == 0, "Rotation_cum"] = 0
 
     # convert to absolute rotation
     cells["Rotation"] = abs(cells["Rotation"])
 
     # convert rotation to revolutions per second
-    cells["Frequency"] = cells["Rotation"] / cells["Time"].diff() / 360
+    cells["Frequency"] = cells["Rotation"] / grouped["Time"].diff() / 360
+
+
+def get_distant(cells, by="ID"):
+    """
+    Input:
+        cells: dataframe of cells labelled by <by>; -1 is never flagged
+        by: column that identifies the cells
+    Output: boolean array of rows further than 1.1 * the 0.9-quantile of Major from the centre of their cell
+    """
+    grouped = cells.groupby(by, sort=False)
+    # distance from mean position
+    dist = distance([grouped.X.transform("mean"), grouped.Y.transform("mean")], [cells.X, cells.Y])
+    # the row(s) nearest to the mean position become the centre
+    nearest = dist == dist.groupby(cells[by], sort=False).transform("min")
+    x_nearest = cells.X.where(nearest).groupby(cells[by], sort=False).transform("mean")
+    y_nearest = cells.Y.where(nearest).groupby(cells[by], sort=False).transform("mean")
+    dist = distance([x_nearest, y_nearest], [cells.X, cells.Y])
+    limit = 1.1 * grouped.Major.transform("quantile", 0.9)
+    return ((dist > limit) & (cells[by] != -1)).values
 
 
 def num_sorted(strings_list):
@@ -105,66 +334,105 @@ def num_sorted(strings_list):
 
 
 class Model:
-    def __init__(self, data):
+    """
+    Input:
+        data: dataframe of grouped cells
+        fast: use a parallel classifier on integer labels instead of a regressor on one-hot labels
+        previous: model of the previous improvement round; its trees are reused in fast mode
+        n_jobs: number of cores used in fast mode
+        max_samples: fraction of rows used to train each tree in fast mode
+        refresh: fraction of reused trees that are retrained on the current labels
+    """
+    def __init__(self, data, fast=False, previous=None, n_jobs=-1, max_samples=None, refresh=0.3):
         self.features = ["X", "Y", "Major", "Minor", "Angle"]
         self.x = data[self.features]
-        self.y = pd.get_dummies(data.ID.astype(str))
-        self.model = RandomForestRegressor().fit(self.x, self.y)
+        self.fast = fast
+        # sklearn is slow to import and only needed for improvement rounds
+        from sklearn.ensemble import RandomForestClassifier, RandomForestRegressor
+        if not fast:
+            self.y = pd.get_dummies(data.ID.astype(str))
+            self.model = RandomForestRegressor().fit(self.x, self.y)
+            self.columns = list(self.y)
+            return
+
+        self.y = data.ID.values
+        if previous is not None and previous.fast and np.array_equal(previous.model.classes_, np.unique(self.y)):
+            # keep most trees of the last round and only retrain the oldest ones on the new labels
+            self.model = previous.model
+            n_trees = len(self.model.estimators_)
+            self.model.estimators_ = self.model.estimators_[int(n_trees * refresh):]
+            self.model.set_params(n_estimators=n_trees)
+        else:
+            self.model = RandomForestClassifier(n_jobs=n_jobs, max_samples=max_samples, warm_start=True)
+        self.model.fit(self.x, self.y)
+        self.columns = self.model.classes_.astype(str).tolist()
 
     def predict(self, data):
-        prediction = self.model.predict(data[self.features])
-        prediction = pd.DataFrame(prediction, columns=list(self.y), index=data.index)
+        if self.fast:
+            prediction = self.model.predict_proba(data[self.features])
+        else:
+            prediction = self.model.predict(data[self.features])
+        prediction = pd.DataFrame(prediction, columns=self.columns, index=data.index)
         return prediction
 
 
+# Brownian thresholds by cell geometry and simulation parameters
+_diffusion_cache = {}
+
+
 class Diffusion:
-    """Model rotational diffusion of a free floating cell"""
-    def __init__(self, data, p=0.01):
-        self.angles = pl.linspace(0, pl.pi, 1001)
-        self.time_step = 0.001
+    """
+    Model rotational diffusion of a free floating cell
+    Input:
+        data: Data object with grouped cells
+        p: p-value of the resulting rotation threshold
+        n_walks: number of simulated random walks
+        time_step: time resolution of the random walks; s
+        seed: seed or numpy Generator for reproducible results
+    """
+    @profiled("diffusion")
+    def __init__(self, data, p=0.01, n_walks=500, time_step=0.001, seed=None):
+        self.angles = np.linspace(0, np.pi, 1001)
+        self.time_step = time_step
         viscosity = 0.00100  # water at 20C; Pa*s = N/m^2 *s
         kb = 1.38e-23  # boltzmann constant; J/K = N*m/K
         temp = 293  # K
         # Cell width and length; m
-        width = pl.median([df.Minor.median() for ID, df in data.dataframe.groupby("ID") if ID != -1])*data.px_to_m
-        length = pl.median([df.Major.median() for ID, df in data.dataframe.groupby("ID") if ID != -1])*data.px_to_m
+        width = np.median([df.Minor.median() for ID, df in data.dataframe.groupby("ID") if ID != -1])*data.px_to_m
+        length = np.median([df.Major.median() for ID, df in data.dataframe.groupby("ID") if ID != -1])*data.px_to_m
 
-        dr = (3 * kb * temp * pl.log(length / width)) / (pl.pi * viscosity * length ** 3)
+        dr = (3 * kb * temp * np.log(length / width)) / (np.pi * viscosity * length ** 3)
         """rotational diffusion coefficient; 1/s; https://aip.scitation.org/doi/full/10.1063/1.5092958 (Eq 10)"""
-        p_dist = []
-        for angle in self.angles:
-            p_dist += self.p_func(angle, self.time_step, dr),
-
-        p_dist = [p/sum(p_dist) for p in p_dist]
-        self.p_dist_cum = pl.cumsum(p_dist)
-
-        results = []
-        n = 500
-        for i in range(n):
-            results += self.rot_max(),
-        log_results = pl.log(results)
-        results = [pl.exp(random.gauss(float(pl.mean(log_results)), float(pl.std(log_results)))) for _ in range(10000)]
-        self.result = pl.quantile(results, 1-p)
+        p_dist = self.p_func(self.angles, self.time_step, dr)
+        self.p_dist_cum = np.cumsum(p_dist / p_dist.sum())
+
+        # a Generator can't be reused as a key, only plain seeds are cached
+        key = (length, width, p, n_walks, time_step, seed)
+        if not isinstance(seed, Generator) and key in _diffusion_cache:
+            self.result = _diffusion_cache[key]
+            return
+
+        rng = default_rng(seed)
+        log_results = np.log(self.rot_max(rng, n_walks))
+        results = np.exp(rng.normal(np.mean(log_results), np.std(log_results), 10000))
+        self.result = np.quantile(results, 1-p)
+        if not isinstance(seed, Generator):
+            _diffusion_cache[key] = self.result
 
     @staticmethod
     def p_func(angle, time, dr):
         """diffusion probability distribution
         https://www.ncbi.nlm.nih.gov/pmc/articles/PMC5453791/ (small T behavior)"""
-        return 1 / pl.sqrt(4 * pl.pi * dr * time) * pl.exp(-(angle ** 2 / (4 * dr * time)))
-
-    def step(self):
-        r = random.random()
-        return random.choice([-1, 1]) * self.angles[len(self.p_dist_cum[r > self.p_dist_cum])]
-
-    def rot_max(self):
-        angle_cum = 0
-        time = 0
-        time_max = 1
-        angle_data = [angle_cum]
-
-        while time < time_max:
-            angle_cum += self.step()
-            time += self.time_step
-            angle_data += angle_cum,
-
-        return max(angle_data) - min(angle_data)
+        return 1 / np.sqrt(4 * np.pi * dr * time) * np.exp(-(angle ** 2 / (4 * dr * time)))
+
+    def steps(self, rng, n, steps):
+        """Draw random rotation steps for n walks at once"""
+        ind = np.searchsorted(self.p_dist_cum, rng.random((n, steps)))
+        return rng.choice([-1, 1], size=(n, steps)) * self.angles[np.minimum(ind, len(self.angles) - 1)]
+
+    def rot_max(self, rng, n, time_max=1):
+        """Range of the cumulative angle of n random walks"""
+        steps = int(round(time_max / self.time_step))
+        angle_data = np.cumsum(self.steps(rng, n, steps), axis=1)
+        angle_data = np.hstack([np.zeros((n, 1)), angle_data])
+        return angle_data.max(axis=1) - angle_data.min(axis=1)
@@ -0,0 +1,133 @@
+"""Vectorized Data methods against frozen copies of the original row-wise implementations"""
+import numpy as np
+import pandas as pd
+import pytest
+from src.data import Data
+from src.util import distance
+
+
+def legacy_relabel(dataframe, score):
+    """Original relabelling of _improve"""
+    ranks = pd.DataFrame(
+        np.asarray(score.columns, dtype=object)[score.apply(np.argsort, axis=1).values[:, ::-1][:, :2]],
+        index=score.index, columns=["1st", "2nd"])
+
+    return dataframe.apply(
+        lambda row: int(ranks.loc[row.name, "1st"])
+        if score.loc[row.name, ranks.loc[row.name, "1st"]] > 0.8
+        or int(ranks.loc[row.name, "1st"]) != row["ID"]
+        else int(ranks.loc[row.name, "2nd"]),
+        axis=1)
+
+
+def legacy_remove_distant(dataframe):
+    """Original proximity filter"""
+    for cell_ID in list(set(dataframe.ID.values)):
+        if cell_ID == -1:
+            continue
+        subset = dataframe[dataframe.ID == cell_ID].copy()
+        xy_mean = subset[["X", "Y"]].mean().values.tolist()
+        subset["Distance"] = distance(xy_mean, [subset["X"], subset["Y"]])
+        xy_nearest = subset.loc[subset.Distance == subset.Distance.min(), ["X", "Y"]].mean().values.tolist()
+        subset["Distance"] = distance(xy_nearest, [subset["X"], subset["Y"]])
+        ind = subset[subset.Distance > 1.1 * subset.Major.quantile(0.9)].index
+        dataframe.loc[ind, "ID"] = -1
+
+
+def legacy_remove_duplicates(dataframe, score):
+    """Original duplicate filter"""
+    duplicates = dataframe[dataframe.duplicated(subset=["Slice", "ID"], keep=False)]
+    duplicates = duplicates[duplicates.ID != -1].groupby(["Slice", "ID"])
+
+    for key, item in duplicates:
+        pair = duplicates.get_group(key)
+        # get full score table
+        score_pair = score.loc[pair.index]
+        # get only the scores for their own ID
+        score_pair = score_pair[[i for i in list(score_pair) if i == str(pair.ID.values[0])]]
+        # get index of cell with the lower score
+        ind = score_pair[score_pair.iloc[:, [0]] != score_pair.max()].dropna().index
+        # change group of the loser to -1
+        dataframe.loc[ind, "ID"] = -1
+
+
+def make_data(seed, cells=6, slices=40):
+    """Grouped cells with some mislabelled rows and a random score table"""
+    rng = np.random.default_rng(seed)
+    rows = cells * slices
+    true_id = np.tile(np.arange(cells), slices)
+    centres = rng.uniform(0, 500, (cells, 2))
+    dataframe = pd.DataFrame({
+        " ": np.arange(1, rows + 1),
+        "X": centres[true_id, 0] + rng.normal(0, 3, rows),
+        "Y": centres[true_id, 1] + rng.normal(0, 3, rows),
+        "Major": rng.uniform(10, 14, rows),
+        "Minor": rng.uniform(4, 6, rows),
+        "Angle": rng.uniform(0, 180, rows),
+        "Slice": np.repeat(np.arange(1, slices + 1), cells),
+        "ID": true_id})
+    # mislabel some rows and move some far away
+    wrong = rng.random(rows) < 0.1
+    dataframe.loc[wrong, "ID"] = rng.integers(-1, cells, wrong.sum())
+    far = rng.random(rows) < 0.03
+    dataframe.loc[far, ["X", "Y"]] += 100
+    # shuffled row labels, as after sorting
+    dataframe.index = rng.permutation(rows) + 1000
+    ids = np.arange(-1, cells)
+    score = pd.DataFrame(rng.dirichlet(np.ones(len(ids)) * 0.3, rows), index=dataframe.index,
+                         columns=ids.astype(str))
+    return dataframe, score
+
+
+def new_data(dataframe, score):
+    data = Data(dataframe.copy())
+    data.dataframe = dataframe.copy()
+    data.score = score
+    return data
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("decimals", [None, 1])
+def test_relabel_and_duplicates(seed, decimals):
+    dataframe, score = make_data(seed)
+    if decimals is not None:
+        # many tied scores, both between IDs of a row and between duplicates of a slice
+        score = score.round(decimals)
+
+    expected = dataframe.copy()
+    expected["ID"] = legacy_relabel(expected, score)
+    data = new_data(dataframe, score)
+    data.remove_distant = lambda: None  # compared separately
+    data._improve()
+
+    assert expected.ID.tolist() != dataframe.ID.tolist()
+    legacy_remove_duplicates(expected, score)
+    assert data.dataframe.ID.tolist() == expected.ID.tolist()
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("decimals", [None, 1])
+def test_remove_duplicates(seed, decimals):
+    dataframe, score = make_data(seed)
+    if decimals is not None:
+        score = score.round(decimals)
+    expected = dataframe.copy()
+    legacy_remove_duplicates(expected, score)
+    data = new_data(dataframe, score)
+    data.remove_duplicates(score)
+    assert (expected.ID == -1).sum() > (dataframe.ID == -1).sum()
+    assert data.dataframe.ID.tolist() == expected.ID.tolist()
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("dtype", ["float64", "float32"])
+@pytest.mark.parametrize("workers", [1, 4])
+def test_remove_distant(seed, dtype, workers):
+    dataframe, score = make_data(seed)
+    dataframe = dataframe.astype({"X": dtype, "Y": dtype, "Major": dtype})
+    expected = dataframe.copy()
+    legacy_remove_distant(expected)
+    data = new_data(dataframe, score)
+    data.remove_distant(workers=workers)
+    assert (expected.ID == -1).sum() > (dataframe.ID == -1).sum()
+    assert data.dataframe.ID.tolist() == expected.ID.tolist()
@@ -0,0 +1,35 @@
+"""Detection of particles in single frames"""
+import numpy as np
+import pandas as pd
+import pytest
+from src.detect import detect
+
+tifffile = pytest.importorskip("tifffile")
+
+
+def write_frame(path, cell=True):
+    """Light background with one dark elongated cell"""
+    image = np.full((64, 64), 200, dtype=np.uint8)
+    if cell:
+        y, x = np.mgrid[:64, :64]
+        image[((x - 32) / 14) ** 2 + ((y - 32) / 2.5) ** 2 <= 1] = 50
+    tifffile.imwrite(path, image)
+    return str(path)
+
+
+@pytest.mark.parametrize("blank", ["uniform", "filtered"])
+def test_empty_frame_keeps_numeric_columns(tmp_path, blank):
+    if blank == "uniform":
+        empty = write_frame(tmp_path / "s-1.tif", cell=False)
+    else:
+        # a particle that is too small is filtered out
+        image = np.full((64, 64), 200, dtype=np.uint8)
+        image[30:33, 30:33] = 50
+        tifffile.imwrite(tmp_path / "s-1.tif", image)
+        empty = str(tmp_path / "s-1.tif")
+    images = [empty, write_frame(tmp_path / "s-2.tif")]
+
+    results = detect(images, workers=1)
+    assert results.Slice.tolist() == [2]
+    for column in ["Area", "Mean", "Min", "Max", "X", "Y", "Major", "Minor", "Angle"]:
+        assert pd.api.types.is_numeric_dtype(results[column]), column